@@ -0,0 +1,111 @@
+import copy
+
+import numpy as np
+
+from DeformationScan import DeformationScan
+from Scan import Scan
+from ScanFilters import ScanFilterPipeline
+from ScanParsers import ScanParserFormTxtBulk
+from ScanStats import ColumnStats
+
+
+class ChunkedScan:
+    # Скан, который не хранится в памяти целиком: каждый проход заново читает файл
+    # блоками по chunk_size точек и пропускает их через накопленные фильтры
+
+    def __init__(self, scan_name, file_path, parser=ScanParserFormTxtBulk, chunk_size=1_000_000, **parser_kwargs):
+        self.name = scan_name
+        self.file_path = file_path
+        self.parser = parser
+        self.chunk_size = chunk_size
+        self.parser_kwargs = parser_kwargs
+        self.filters = []
+        self.count = None
+        self.deformation_stats = None
+        self.min_deformation = None
+        self.max_deformation = None
+        self.mse = None
+        self.borders = {"x_min": None,
+                        "x_max": None,
+                        "y_min": None,
+                        "y_max": None,
+                        "z_min": None,
+                        "z_max": None,
+                        }
+
+    def __str__(self):
+        return (f"{self.__class__.__name__} (scan_name={self.name}, num_of_point={self.count}, "
+                f"chunk_size={self.chunk_size}, borders={self.borders})")
+
+    def filter_scan(self, filter_cls, *args, **kwargs):
+        # Фильтры применяются лениво - к каждому блоку при следующих проходах.
+        # Фильтр видит только свой блок: маски (ScanFilterFromMask) индексируют точки блока,
+        # а не всего скана, воксели прореживания на стыке блоков дают по точке из каждого блока
+        self.filters.append(filter_cls(*args, **kwargs))
+        self.count = None
+        return self
+
+    def iter_chunks(self, scan_cls=Scan):
+        parser = self.parser(self.file_path, chunk_size=self.chunk_size, **self.parser_kwargs)
+        # Свежая копия фильтров на каждый проход, чтобы фильтры с состоянием
+        # (например, ScanDelimiter) выбирали одни и те же точки
+        pipeline = ScanFilterPipeline(copy.deepcopy(self.filters))
+        for idx, (x, y, z, color) in enumerate(parser.iter_chunks()):
+            chunk = scan_cls(scan_name=f"{self.name}_chunk_{idx}")
+            chunk.add_points(x, y, z, color=color)
+            if pipeline.filters:
+                indices = pipeline.get_indices(chunk)
+                if len(indices) == 0:
+                    continue
+                if len(indices) < len(chunk):
+                    chunk._set_columns(chunk._take(indices))
+                    chunk.borders = chunk._calc_borders()
+            yield chunk
+
+    def calc_stats(self):
+        stats = {axis: ColumnStats() for axis in ("x", "y", "z")}
+        for chunk in self.iter_chunks():
+            for axis, axis_stats in stats.items():
+                axis_stats.update(getattr(chunk, axis))
+        self.count = stats["x"].count
+        for axis, axis_stats in stats.items():
+            self.borders[f"{axis}_min"] = axis_stats.min
+            self.borders[f"{axis}_max"] = axis_stats.max
+        return stats
+
+    def get_sample(self, sample_size, seed=None):
+        # Равномерная выборка без возвращения за один проход: у каждой точки случайный ключ,
+        # в выборке остаются sample_size точек с наименьшими ключами
+        rng = np.random.default_rng(seed)
+        sample = Scan(scan_name=f"{self.name}_sample")
+        keys = np.empty(0)
+        for chunk in self.iter_chunks():
+            columns = {name: np.concatenate((getattr(sample, name), getattr(chunk, name)))
+                       for name in sample._columns}
+            keys = np.concatenate((keys, rng.random(len(chunk))))
+            if len(keys) > sample_size:
+                keep = np.sort(np.argpartition(keys, sample_size)[:sample_size])
+                columns = {name: column[keep] for name, column in columns.items()}
+                keys = keys[keep]
+            sample._set_columns(columns)
+        sample.borders = sample._calc_borders()
+        return sample
+
+    def iter_deformation_chunks(self, deformation_calculator, *args, def_scan_cls=DeformationScan, **kwargs):
+        # Статистика деформаций накапливается по мере обработки блоков
+        # и доступна в self.deformation_stats после окончания прохода
+        deformation_calculator = deformation_calculator(*args, **kwargs)
+        stats = ColumnStats()
+        for chunk in self.iter_chunks():
+            def_chunk = def_scan_cls.create_def_scan_from_scan(chunk)
+            deformation_calculator.calculate(def_scan=def_chunk)
+            def_chunk._points_changed()
+            chunk_stats = ColumnStats().update(def_chunk.deformation)
+            def_chunk.min_deformation, def_chunk.max_deformation = chunk_stats.min, chunk_stats.max
+            def_chunk.mse = chunk_stats.rms
+            stats.merge(chunk_stats)
+            yield def_chunk
+        self.deformation_stats = stats
+        self.min_deformation = stats.min
+        self.max_deformation = stats.max
+        self.mse = stats.rms
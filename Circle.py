@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve
 
 
 class Circle:
@@ -11,43 +12,152 @@ class Circle:
     def __str__(self):
         return f"Circle (center=({self.x0:.4f}, {self.y0:.4f}), R={self.r:.4f})"
 
-    def _get_a_matrix(self, scan):
-        a_lst = []
-        for point in scan:
-            r = ((point.x - self.x0) ** 2 + (point.y - self.y0) ** 2) ** 0.5
-            a = -(point.x - self.x0) / r
-            b = -(point.y - self.y0) / r
-            c = -1
-            a_lst.append([a, b, c])
-        return np.array(a_lst)
-
-    def _get_l_vector(self, scan):
-        l_vct = []
-        for point in scan:
-            r = ((point.x - self.x0) ** 2 + (point.y - self.y0) ** 2) ** 0.5
-            l = r - self.r
-            l_vct.append([l])
-        return np.array(l_vct)
-
-    def _get_dt(self, scan):
-        a = self._get_a_matrix(scan)
-        l = self._get_l_vector(scan)
-        n = a.T @ a
-        q = np.linalg.inv(n)
-        t = -q @ a.T @ l
-        return t
+    @classmethod
+    def create_circle_by_kasa(cls, x, y, weights=None, chunk_size=1_000_000):
+        x_m, y_m = float(np.mean(x)), float(np.mean(y))
+        n, b = cls._get_kasa_normal_equations(x, y, x_m, y_m, weights=weights, chunk_size=chunk_size)
+        return cls._solve_kasa(n, b, x_m, y_m)
 
-    def best_fit_circle_in_scan(self, scan, max_iteration=50, max_tolerance=1e-4, print_log=True):
+    @classmethod
+    def create_circle_by_kasa_in_chunks(cls, chunks):
+        # Суммы нормальных уравнений накапливаются по блокам, центрирование - по первому блоку
+        n = np.zeros((3, 3))
+        b = np.zeros(3)
+        x_m = y_m = None
+        for chunk in chunks:
+            if x_m is None:
+                x_m, y_m = float(np.mean(chunk.x)), float(np.mean(chunk.y))
+            n_chunk, b_chunk = cls._get_kasa_normal_equations(chunk.x, chunk.y, x_m, y_m)
+            n += n_chunk
+            b += b_chunk
+        if x_m is None:
+            raise ValueError("Нет точек для вписывания окружности!")
+        return cls._solve_kasa(n, b, x_m, y_m)
+
+    @staticmethod
+    def _get_kasa_normal_equations(x, y, x_m, y_m, weights=None, chunk_size=1_000_000):
+        n = np.zeros((3, 3))
+        b = np.zeros(3)
+        for start in range(0, len(x), chunk_size):
+            stop = start + chunk_size
+            u, v = x[start:stop] - x_m, y[start:stop] - y_m
+            a = np.column_stack((u, v, np.ones_like(u)))
+            if weights is not None:
+                a_w = a * weights[start:stop, None]
+            else:
+                a_w = a
+            n += a_w.T @ a
+            b += a_w.T @ (u ** 2 + v ** 2)
+        return n, b
+
+    @classmethod
+    def _solve_kasa(cls, n, b, x_m, y_m):
+        a_c, b_c, c = cho_solve(cho_factor(n), b)
+        u0, v0 = a_c / 2, b_c / 2
+        return cls(x0=x_m + u0, y0=y_m + v0, r=(c + u0 ** 2 + v0 ** 2) ** 0.5)
+
+    def _get_a_matrix(self, x, y):
+        dx, dy = x - self.x0, y - self.y0
+        r = np.hypot(dx, dy)
+        return np.column_stack((-dx / r, -dy / r, -np.ones_like(r))), r
+
+    def _get_l_vector(self, r):
+        return r - self.r
+
+    def _get_normal_equations(self, x, y, weights=None, chunk_size=1_000_000):
+        n = np.zeros((3, 3))
+        b = np.zeros(3)
+        for start in range(0, len(x), chunk_size):
+            stop = start + chunk_size
+            a, r = self._get_a_matrix(x[start:stop], y[start:stop])
+            l = self._get_l_vector(r)
+            if weights is not None:
+                a_w = a * weights[start:stop, None]
+            else:
+                a_w = a
+            n += a_w.T @ a
+            b += a_w.T @ l
+        return n, b
+
+    def _get_dt(self, x, y, weights=None):
+        n, b = self._get_normal_equations(x, y, weights=weights)
+        return -cho_solve(cho_factor(n), b)
+
+    def best_fit_circle_in_xy(self, x, y, weights=None, max_iteration=50, max_tolerance=1e-4, print_log=True):
+        for i in range(max_iteration):
+            t = self._get_dt(x, y, weights=weights)
+            if self._apply_dt(t, i, max_tolerance, print_log):
+                break
+
+    def best_fit_circle_in_chunks(self, chunked_scan, weights_function=None, max_iteration=50, max_tolerance=1e-4,
+                                  print_log=True):
+        # Каждая итерация - один проход по блокам скана с накоплением нормальных уравнений
         for i in range(max_iteration):
-            t = self._get_dt(scan)
-            self.x0 += t[0][0]
-            self.y0 += t[1][0]
-            self.r += t[2][0]
-            if print_log:
-                print("*" * 25, f"iteration - {i}","*" * 25)
-                print(t.T)
-                print(self)
-            if abs(max(t)[0]) < max_tolerance:
+            n = np.zeros((3, 3))
+            b = np.zeros(3)
+            for chunk in chunked_scan.iter_chunks():
+                weights = None if weights_function is None else weights_function(chunk)
+                n_chunk, b_chunk = self._get_normal_equations(chunk.x, chunk.y, weights=weights)
+                n += n_chunk
+                b += b_chunk
+            t = -cho_solve(cho_factor(n), b)
+            if self._apply_dt(t, i, max_tolerance, print_log):
                 break
 
+    def _apply_dt(self, t, iteration, max_tolerance, print_log):
+        self.x0 += t[0]
+        self.y0 += t[1]
+        self.r += t[2]
+        if print_log:
+            print("*" * 25, f"iteration - {iteration}","*" * 25)
+            print(t)
+            print(self)
+        return np.abs(t).max() < max_tolerance
+
+    def best_fit_circle_in_scan(self, scan, max_iteration=50, max_tolerance=1e-4, print_log=True):
+        self.best_fit_circle_in_xy(scan.x, scan.y,
+                                   max_iteration=max_iteration,
+                                   max_tolerance=max_tolerance,
+                                   print_log=print_log)
+
+
+if __name__ == "__main__":
+    import time
+
+    def legacy_dt(circle, x, y):
+        a_lst, l_vct = [], []
+        for x_, y_ in zip(x, y):
+            r = ((x_ - circle.x0) ** 2 + (y_ - circle.y0) ** 2) ** 0.5
+            a_lst.append([-(x_ - circle.x0) / r, -(y_ - circle.y0) / r, -1])
+            l_vct.append([r - circle.r])
+        a, l = np.array(a_lst), np.array(l_vct)
+        return -np.linalg.inv(a.T @ a) @ a.T @ l
+
+    rng = np.random.default_rng(0)
+    n_points = 10_000_000
+    azimuth = rng.uniform(0, 2 * np.pi, n_points)
+    radius = 22.8 + rng.normal(0, 0.01, n_points)
+    x = 1344089.5 + radius * np.cos(azimuth)
+    y = 489107.5 + radius * np.sin(azimuth)
+
+    n_legacy = 200_000
+    t0 = time.perf_counter()
+    legacy_dt(Circle(1344089, 489107, 22), x[:n_legacy], y[:n_legacy])
+    legacy_time = (time.perf_counter() - t0) * n_points / n_legacy
+    print(f"legacy iteration (extrapolated to {n_points} pts): {legacy_time:.2f} s")
+
+    t0 = time.perf_counter()
+    circle = Circle(1344089, 489107, 22)
+    circle._get_dt(x, y)
+    print(f"vectorized iteration: {time.perf_counter() - t0:.2f} s")
+
+    t0 = time.perf_counter()
+    circle = Circle.create_circle_by_kasa(x, y)
+    print(f"Kasa initializer: {time.perf_counter() - t0:.2f} s  {circle}")
+    circle.best_fit_circle_in_xy(x, y, print_log=False)
+    print(f"Kasa + Gauss-Newton fit: {time.perf_counter() - t0:.2f} s  {circle}")
 
+    t0 = time.perf_counter()
+    circle = Circle(1344089, 489107, 22)
+    circle.best_fit_circle_in_xy(x, y, print_log=False)
+    print(f"Gauss-Newton fit from rough guess: {time.perf_counter() - t0:.2f} s  {circle}")
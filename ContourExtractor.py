@@ -0,0 +1,144 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Рёбра ячейки: 0 - нижнее, 1 - правое, 2 - верхнее, 3 - левое.
+# Для каждого случая (бит 0 - левый нижний угол, 1 - правый нижний, 2 - правый верхний, 3 - левый верхний)
+# перечислены пары рёбер, которые соединяет изолиния. Для седловых случаев 5 и 10
+# первый вариант используется, когда значение в центре ячейки ниже уровня, второй - когда выше.
+_CASE_SEGMENTS = {1: ((3, 0),), 2: ((0, 1),), 3: ((3, 1),), 4: ((1, 2),),
+                  6: ((0, 2),), 7: ((3, 2),), 8: ((2, 3),), 9: ((0, 2),),
+                  11: ((1, 2),), 12: ((3, 1),), 13: ((0, 1),), 14: ((3, 0),),
+                  }
+_SADDLE_SEGMENTS = {5: (((3, 0), (1, 2)), ((0, 1), (2, 3))),
+                    10: (((0, 1), (2, 3)), ((3, 0), (1, 2))),
+                    }
+
+_worker_extractor = None
+
+
+def _init_worker(x_coords, y_coords, values):
+    global _worker_extractor
+    _worker_extractor = MarchingSquares(x_coords, y_coords, values)
+
+
+def _get_worker_isolines(level):
+    return _worker_extractor.get_isolines(level)
+
+
+class MarchingSquares:
+
+    def __init__(self, x_coords, y_coords, values):
+        self.x_coords = np.asarray(x_coords, dtype=np.float64)
+        self.y_coords = np.asarray(y_coords, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.ny, self.nx = self.values.shape
+        self._count_of_h_edges = self.ny * (self.nx - 1)
+
+    def _get_cell_edges(self, i, j):
+        bottom = i * (self.nx - 1) + j
+        top = bottom + (self.nx - 1)
+        left = self._count_of_h_edges + i * self.nx + j
+        return np.stack((bottom, left + 1, top, left))
+
+    def _get_segments(self, level):
+        v = self.values
+        above = v > level
+        cases = (above[:-1, :-1].astype(np.uint8) | above[:-1, 1:] << 1
+                 | above[1:, 1:] << 2 | above[1:, :-1] << 3)
+        valid = ~np.isnan(v)
+        valid = valid[:-1, :-1] & valid[:-1, 1:] & valid[1:, 1:] & valid[1:, :-1]
+        cases[~valid] = 0
+        edge_a, edge_b = [], []
+        for case, pairs in _CASE_SEGMENTS.items():
+            i, j = np.nonzero(cases == case)
+            cell_edges = self._get_cell_edges(i, j)
+            for a, b in pairs:
+                edge_a.append(cell_edges[a])
+                edge_b.append(cell_edges[b])
+        for case, variants in _SADDLE_SEGMENTS.items():
+            i, j = np.nonzero(cases == case)
+            center = (v[i, j] + v[i, j + 1] + v[i + 1, j + 1] + v[i + 1, j]) / 4
+            cell_edges = self._get_cell_edges(i, j)
+            for variant, mask in zip(variants, (center <= level, center > level)):
+                for a, b in variant:
+                    edge_a.append(cell_edges[a][mask])
+                    edge_b.append(cell_edges[b][mask])
+        if not edge_a:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        return np.concatenate(edge_a), np.concatenate(edge_b)
+
+    def _get_edge_points(self, edges, level):
+        points = np.empty((len(edges), 2))
+        horizontal = edges < self._count_of_h_edges
+        i, j = np.divmod(edges[horizontal], self.nx - 1)
+        va, vb = self.values[i, j], self.values[i, j + 1]
+        t = (level - va) / (vb - va)
+        points[horizontal, 0] = self.x_coords[j] + t * (self.x_coords[j + 1] - self.x_coords[j])
+        points[horizontal, 1] = self.y_coords[i]
+        i, j = np.divmod(edges[~horizontal] - self._count_of_h_edges, self.nx)
+        va, vb = self.values[i, j], self.values[i + 1, j]
+        t = (level - va) / (vb - va)
+        points[~horizontal, 0] = self.x_coords[j]
+        points[~horizontal, 1] = self.y_coords[i] + t * (self.y_coords[i + 1] - self.y_coords[i])
+        return points
+
+    @staticmethod
+    def _link_segments(edge_a, edge_b):
+        count = len(edge_a)
+        edges = np.concatenate((edge_a, edge_b))
+        order = np.argsort(edges, kind="stable")
+        sorted_edges = edges[order]
+        pairs = np.flatnonzero(sorted_edges[1:] == sorted_edges[:-1])
+        neighbour = np.full(2 * count, -1, dtype=np.intp)
+        neighbour[order[pairs]] = order[pairs + 1]
+        neighbour[order[pairs + 1]] = order[pairs]
+        return neighbour
+
+    @staticmethod
+    def _walk(end, start, neighbour, visited, count):
+        path = []
+        while True:
+            other = neighbour[end]
+            if other < 0:
+                return path, False
+            segment = other - count if other >= count else other
+            if visited[segment]:
+                return path, segment == start
+            visited[segment] = 1
+            end = other + count if other < count else other - count
+            path.append(end)
+
+    def get_isolines(self, level):
+        edge_a, edge_b = self._get_segments(level)
+        count = len(edge_a)
+        if count == 0:
+            return []
+        # Концы отрезков: k - начало отрезка k, k + count - его конец
+        points = self._get_edge_points(np.concatenate((edge_a, edge_b)), level)
+        neighbour = self._link_segments(edge_a, edge_b).tolist()
+        visited = bytearray(count)
+        polylines = []
+        for start in range(count):
+            if visited[start]:
+                continue
+            visited[start] = 1
+            forward, closed = self._walk(start + count, start, neighbour, visited, count)
+            backward = [] if closed else self._walk(start, start, neighbour, visited, count)[0]
+            path = backward[::-1] + [start, start + count] + forward
+            if closed:
+                path.append(start)
+            polylines.append(points[path])
+        return polylines
+
+    def iter_contours(self, levels, processes=1):
+        if processes == 1:
+            for level in levels:
+                yield level, self.get_isolines(level)
+            return
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(self.x_coords, self.y_coords, self.values)) as executor:
+            yield from zip(levels, executor.map(_get_worker_isolines, levels))
+
+    def get_contours(self, levels, processes=1):
+        return dict(self.iter_contours(levels, processes=processes))
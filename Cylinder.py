@@ -1,13 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
 from Circle import Circle
+from CylindricalProjection import CylindricalProjection
 from Scan import Scan
+from ScanStats import ColumnStats
 
 
 class Cylinder:
 
-    def __init__(self, circle: Circle, z_min, z_max):
+    def __init__(self, circle: Circle, z_min, z_max, tilt_x=0.0, tilt_y=0.0, z0=None):
         self.circle = circle
         self.z_min = z_min
         self.z_max = z_max
+        self.tilt_x = tilt_x
+        self.tilt_y = tilt_y
+        self.z0 = (z_min + z_max) / 2 if z0 is None else z0
 
     @property
     def x0(self):
@@ -22,16 +33,430 @@ class Cylinder:
         return self.circle.r
 
     def __str__(self):
-        return f"Cylinder (circle={self.circle}, z_min={self.z_min}, z_max={self.z_max})"
+        s_str = f"Cylinder (circle={self.circle}, z_min={self.z_min}, z_max={self.z_max})"
+        if self.tilt_x or self.tilt_y:
+            s_str = f"{s_str[:-1]}, tilt=({self.tilt_x:.6f}, {self.tilt_y:.6f}), z0={self.z0:.3f})"
+        return s_str
+
+    def get_axis_frame(self):
+        return CylindricalProjection.get_axis_frame(self.tilt_x, self.tilt_y)
+
+    def _get_axis_offsets(self, x, y, z):
+        return x - self.x0, y - self.y0, z - self.z0
+
+    def get_projection(self):
+        return CylindricalProjection(self)
+
+    def to_cylindrical(self, x, y, z):
+        return self.get_projection().to_cylindrical(x, y, z)
+
+    def from_cylindrical(self, h, azimuth, radius):
+        return self.get_projection().from_cylindrical(h, azimuth, radius)
+
+    def get_radial_distance(self, x, y, z):
+        if not (self.tilt_x or self.tilt_y):
+            return np.hypot(x - self.x0, y - self.y0)
+        wx, wy, wz = self._get_axis_offsets(x, y, z)
+        q = wx * self.tilt_x + wy * self.tilt_y + wz
+        s = self.tilt_x ** 2 + self.tilt_y ** 2 + 1
+        return np.sqrt(np.maximum(wx ** 2 + wy ** 2 + wz ** 2 - q ** 2 / s, 0))
+
+    def get_deviation(self, x, y, z):
+        return self.get_radial_distance(x, y, z) - self.r
+
+    def _get_a_matrix(self, x, y, z):
+        a, b = self.tilt_x, self.tilt_y
+        wx, wy, wz = self._get_axis_offsets(x, y, z)
+        s = a ** 2 + b ** 2 + 1
+        q = wx * a + wy * b + wz
+        d = np.sqrt(np.maximum(wx ** 2 + wy ** 2 + wz ** 2 - q ** 2 / s, 1e-12))
+        q_s, q2_s2 = q / s, q ** 2 / s ** 2
+        a_matrix = np.column_stack(((-wx + q_s * a) / d,
+                                    (-wy + q_s * b) / d,
+                                    (-q_s * wx + a * q2_s2) / d,
+                                    (-q_s * wy + b * q2_s2) / d,
+                                    -np.ones_like(d)))
+        return a_matrix, d
+
+    def _get_normal_equations(self, x, y, z, weights=None, chunk_size=1_000_000):
+        n = np.zeros((5, 5))
+        b = np.zeros(5)
+        for start in range(0, len(x), chunk_size):
+            stop = start + chunk_size
+            a, d = self._get_a_matrix(x[start:stop], y[start:stop], z[start:stop])
+            l = d - self.r
+            a_w = a if weights is None else a * weights[start:stop, None]
+            n += a_w.T @ a
+            b += a_w.T @ l
+        return n, b
+
+    def _get_dt(self, x, y, z, weights=None, chunk_size=1_000_000):
+        n, b = self._get_normal_equations(x, y, z, weights=weights, chunk_size=chunk_size)
+        return -cho_solve(cho_factor(n), b)
+
+    def best_fit_cylinder_in_xyz(self, x, y, z, weights=None, max_iteration=50, max_tolerance=1e-4,
+                                 print_log=True):
+        for i in range(max_iteration):
+            t = self._get_dt(x, y, z, weights=weights)
+            if self._apply_dt(t, i, max_tolerance, print_log):
+                break
+
+    def best_fit_cylinder_in_chunks(self, chunked_scan, weights_function=None, max_iteration=50, max_tolerance=1e-4,
+                                    print_log=True):
+        for i in range(max_iteration):
+            n = np.zeros((5, 5))
+            b = np.zeros(5)
+            for chunk in chunked_scan.iter_chunks():
+                weights = None if weights_function is None else weights_function(chunk)
+                n_chunk, b_chunk = self._get_normal_equations(chunk.x, chunk.y, chunk.z, weights=weights)
+                n += n_chunk
+                b += b_chunk
+            t = -cho_solve(cho_factor(n), b)
+            if self._apply_dt(t, i, max_tolerance, print_log):
+                break
+
+    def _apply_dt(self, t, iteration, max_tolerance, print_log):
+        self.circle.x0 += t[0]
+        self.circle.y0 += t[1]
+        self.tilt_x += t[2]
+        self.tilt_y += t[3]
+        self.circle.r += t[4]
+        if print_log:
+            print("*" * 25, f"iteration - {iteration}", "*" * 25)
+            print(t)
+            print(self)
+        return np.abs(t).max() < max_tolerance
 
     @classmethod
-    def best_fit_cylinder_in_scan(cls, x0, y0, r0, scan: Scan, max_iteration=50, max_tolerance=1e-4, print_log=True):
-        circle_0 = Circle(x0=x0, y0=y0, r=r0)
+    def best_fit_tilted_cylinder_in_scan(cls, scan: Scan, cylinder_0=None, max_iteration=50, max_tolerance=1e-4,
+                                         print_log=True):
+        if cylinder_0 is None:
+            cylinder_0 = cls.best_fit_cylinder_in_scan(scan=scan, max_iteration=max_iteration,
+                                                       max_tolerance=max_tolerance, print_log=False)
+        cylinder = cls(circle=Circle(x0=cylinder_0.x0, y0=cylinder_0.y0, r=cylinder_0.r),
+                       z_min=scan.stats.z.min,
+                       z_max=scan.stats.z.max,
+                       tilt_x=cylinder_0.tilt_x,
+                       tilt_y=cylinder_0.tilt_y,
+                       )
+        cylinder._move_axis_point(cylinder_0)
+        cylinder.best_fit_cylinder_in_xyz(scan.x, scan.y, scan.z,
+                                          max_iteration=max_iteration,
+                                          max_tolerance=max_tolerance,
+                                          print_log=print_log)
+        return cylinder
+
+    def _move_axis_point(self, cylinder):
+        dz = self.z0 - cylinder.z0
+        self.circle.x0 = cylinder.x0 + cylinder.tilt_x * dz
+        self.circle.y0 = cylinder.y0 + cylinder.tilt_y * dz
+
+    @classmethod
+    def best_fit_cylinder_in_scan(cls, scan: Scan, x0=None, y0=None, r0=None,
+                                  max_iteration=50, max_tolerance=1e-4, print_log=True):
+        if x0 is None or y0 is None or r0 is None:
+            circle_0 = Circle.create_circle_by_kasa(scan.x, scan.y)
+        else:
+            circle_0 = Circle(x0=x0, y0=y0, r=r0)
         circle_0.best_fit_circle_in_scan(scan=scan,
                                          max_iteration=max_iteration,
                                          max_tolerance=max_tolerance,
                                          print_log=print_log)
         return cls(circle=circle_0,
-                   z_min=scan.borders["z_min"],
-                   z_max=scan.borders["z_max"],
-                   )
\ No newline at end of file
+                   z_min=scan.stats.z.min,
+                   z_max=scan.stats.z.max,
+                   )
+
+    @classmethod
+    def best_fit_cylinder_in_chunked_scan(cls, chunked_scan, max_iteration=50, max_tolerance=1e-4, print_log=True):
+        # Начальное приближение Каса и уточнение - по суммам нормальных уравнений всех блоков
+        circle_0 = Circle.create_circle_by_kasa_in_chunks(chunked_scan.iter_chunks())
+        circle_0.best_fit_circle_in_chunks(chunked_scan,
+                                           max_iteration=max_iteration,
+                                           max_tolerance=max_tolerance,
+                                           print_log=print_log)
+        if chunked_scan.count is None:
+            chunked_scan.calc_stats()
+        return cls(circle=circle_0,
+                   z_min=chunked_scan.borders["z_min"],
+                   z_max=chunked_scan.borders["z_max"],
+                   )
+
+    @staticmethod
+    def _get_sample_indices(z, sample_size, stratified=True, seed=None):
+        rng = np.random.default_rng(seed)
+        if sample_size is None or sample_size >= len(z):
+            return np.arange(len(z))
+        if not stratified:
+            return np.sort(rng.choice(len(z), size=sample_size, replace=False))
+        count_of_strata = max(1, min(100, sample_size // 1000))
+        edges = np.linspace(z.min(), z.max(), count_of_strata + 1)
+        strata = np.clip(np.searchsorted(edges, z, side="right") - 1, 0, count_of_strata - 1)
+        order = np.argsort(strata, kind="stable")
+        bounds = np.searchsorted(strata[order], np.arange(count_of_strata + 1))
+        per_stratum = sample_size // count_of_strata
+        indices = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            size = min(per_stratum, stop - start)
+            if size > 0:
+                indices.append(order[start + rng.choice(stop - start, size=size, replace=False)])
+        return np.sort(np.concatenate(indices))
+
+    @staticmethod
+    def _get_robust_scale(residuals):
+        mad = np.median(np.abs(residuals - np.median(residuals)))
+        return max(1.4826 * mad, 1e-6)
+
+    @staticmethod
+    def _get_weights(residuals, method, scale=None, tolerance=None):
+        abs_residuals = np.abs(residuals)
+        if method == "trim":
+            return (abs_residuals < tolerance).astype(np.float64)
+        if method == "huber":
+            k = 1.345 * scale
+            return np.where(abs_residuals <= k, 1.0, k / np.maximum(abs_residuals, k))
+        if method == "tukey":
+            u = residuals / (4.685 * scale)
+            return np.where(np.abs(u) < 1, (1 - u ** 2) ** 2, 0.0)
+        raise ValueError(f"Неизвестный метод робастной оценки - {method}!")
+
+    @staticmethod
+    def _get_residuals(circle, x, y):
+        return np.hypot(x - circle.x0, y - circle.y0) - circle.r
+
+    @classmethod
+    def robust_fit_cylinder_in_scan(cls, scan: Scan, method="tukey", inlier_tolerance=None,
+                                    tolerances=(0.5, 0.3, 0.2, 0.15, 0.10, 0.075, 0.05),
+                                    sample_size=200_000, stratified=True, seed=None,
+                                    max_reweighting=20, max_iteration=10, max_tolerance=1e-4,
+                                    fit_axis_tilt=False, max_tilt_reweighting=3, print_log=True):
+        x, y, z = scan.x, scan.y, scan.z
+        sample = cls._get_sample_indices(z, sample_size, stratified=stratified, seed=seed)
+        x_s, y_s = x[sample], y[sample]
+        circle = Circle.create_circle_by_kasa(x_s, y_s)
+        if method == "trim":
+            schedule = [("trim", tol) for tol in tolerances]
+        else:
+            schedule = [("huber" if method == "tukey" and i == 0 else method, None) for i in range(max_reweighting)]
+        weights = np.ones_like(x_s)
+        for step, (step_method, step_tolerance) in enumerate(schedule):
+            residuals = cls._get_residuals(circle, x_s, y_s)
+            scale = cls._get_robust_scale(residuals[weights > 0])
+            weights = cls._get_weights(residuals, step_method, scale=scale, tolerance=step_tolerance)
+            x0, y0, r = circle.x0, circle.y0, circle.r
+            circle.best_fit_circle_in_xy(x_s, y_s, weights=weights, max_iteration=max_iteration,
+                                         max_tolerance=max_tolerance, print_log=False)
+            if print_log:
+                print(f"{step_method} step {step}: {circle}, scale={scale:.4f}, "
+                      f"inliers={np.count_nonzero(weights) / len(weights):.1%}")
+            shift = max(abs(circle.x0 - x0), abs(circle.y0 - y0), abs(circle.r - r))
+            if step_tolerance is None and shift < max_tolerance:
+                break
+        final_tolerance = tolerances[-1] if method == "trim" else None
+        residuals = cls._get_residuals(circle, x, y)
+        weights = cls._get_weights(residuals, method, scale=scale, tolerance=final_tolerance)
+        cylinder = cls(circle=circle, z_min=scan.stats.z.min, z_max=scan.stats.z.max)
+        if fit_axis_tilt:
+            for _ in range(max_tilt_reweighting):
+                cylinder.best_fit_cylinder_in_xyz(x, y, z, weights=weights, max_iteration=max_iteration,
+                                                  max_tolerance=max_tolerance, print_log=print_log)
+                residuals = cylinder.get_deviation(x, y, z)
+                scale = cls._get_robust_scale(residuals[weights > 0])
+                weights = cls._get_weights(residuals, method, scale=scale, tolerance=final_tolerance)
+        else:
+            circle.best_fit_circle_in_xy(x, y, weights=weights, max_iteration=max_iteration,
+                                         max_tolerance=max_tolerance, print_log=print_log)
+        residuals = cylinder.get_deviation(x, y, z)
+        if inlier_tolerance is None:
+            inlier_tolerance = final_tolerance if final_tolerance is not None else 3 * scale
+        inlier_mask = np.abs(residuals) < inlier_tolerance
+        if not inlier_mask.any():
+            raise ValueError(f"Ни одна точка не попала в допуск {inlier_tolerance} от стенки цилиндра {cylinder}!")
+        cylinder.z_min = float(z[inlier_mask].min())
+        cylinder.z_max = float(z[inlier_mask].max())
+        return cylinder, inlier_mask
+
+    @classmethod
+    def robust_fit_cylinder_in_chunked_scan(cls, chunked_scan, method="tukey", inlier_tolerance=None,
+                                            sample_size=200_000, seed=None, max_iteration=10, max_tolerance=1e-4, fit_axis_tilt=False,
+                                            print_log=True, **kwargs):
+        # Грубая робастная оценка по равномерной выборке из всех блоков,
+        # затем уточнение по всем точкам с весами, пересчитываемыми в каждом блоке
+        sample = chunked_scan.get_sample(sample_size, seed=seed)
+        cylinder, inlier_mask = cls.robust_fit_cylinder_in_scan(sample, method=method,
+                                                                inlier_tolerance=inlier_tolerance,
+                                                                sample_size=None, max_iteration=max_iteration,
+                                                                max_tolerance=max_tolerance,
+                                                                fit_axis_tilt=fit_axis_tilt, print_log=False,
+                                                                **kwargs)
+        residuals = cylinder.get_deviation(sample.x, sample.y, sample.z)
+        scale = cls._get_robust_scale(residuals[inlier_mask])
+        if inlier_tolerance is None:
+            inlier_tolerance = 3 * scale
+
+        def get_weights(chunk):
+            chunk_residuals = cylinder.get_deviation(chunk.x, chunk.y, chunk.z)
+            if method == "trim":
+                return cls._get_weights(chunk_residuals, method, tolerance=inlier_tolerance)
+            return cls._get_weights(chunk_residuals, method, scale=scale)
+
+        if fit_axis_tilt:
+            cylinder.best_fit_cylinder_in_chunks(chunked_scan, weights_function=get_weights,
+                                                 max_iteration=max_iteration, max_tolerance=max_tolerance,
+                                                 print_log=print_log)
+        else:
+            cylinder.circle.best_fit_circle_in_chunks(chunked_scan, weights_function=get_weights,
+                                                      max_iteration=max_iteration, max_tolerance=max_tolerance,
+                                                      print_log=print_log)
+        z_stats = ColumnStats()
+        for chunk in chunked_scan.iter_chunks():
+            z_stats.update(chunk.z[np.abs(cylinder.get_deviation(chunk.x, chunk.y, chunk.z)) < inlier_tolerance])
+        if z_stats.count == 0:
+            raise ValueError(f"Ни одна точка не попала в допуск {inlier_tolerance} от стенки цилиндра {cylinder}!")
+        cylinder.z_min, cylinder.z_max = z_stats.min, z_stats.max
+        return cylinder, inlier_tolerance
+
+
+_belt_worker_shm = None
+_belt_worker_coords = None
+
+
+def _init_belt_worker(shm_name, count_of_points):
+    global _belt_worker_shm, _belt_worker_coords
+    _belt_worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _belt_worker_coords = np.ndarray((3, count_of_points), dtype=np.float64, buffer=_belt_worker_shm.buf)
+
+
+def _fit_belt_circle(x, y, max_iteration, max_tolerance):
+    circle = Circle.create_circle_by_kasa(x, y)
+    circle.best_fit_circle_in_xy(x, y, max_iteration=max_iteration, max_tolerance=max_tolerance, print_log=False)
+    return float(circle.x0), float(circle.y0), float(circle.r)
+
+
+def _fit_belt(start, stop, max_iteration, max_tolerance):
+    return _fit_belt_circle(_belt_worker_coords[0, start:stop], _belt_worker_coords[1, start:stop],
+                            max_iteration, max_tolerance)
+
+
+class StackedCylinder:
+
+    def __init__(self, cylinders):
+        self.cylinders = sorted(cylinders, key=lambda cylinder: cylinder.z_min)
+
+    def __len__(self):
+        return len(self.cylinders)
+
+    def __iter__(self):
+        return iter(self.cylinders)
+
+    def __str__(self):
+        belts = "\n".join(f"  {idx}: {cylinder}" for idx, cylinder in enumerate(self.cylinders))
+        return f"{self.__class__.__name__} (count_of_belts={len(self)}):\n{belts}"
+
+    @property
+    def z_min(self):
+        return self.cylinders[0].z_min
+
+    @property
+    def z_max(self):
+        return self.cylinders[-1].z_max
+
+    def get_belt_indices(self, z):
+        edges = np.array([cylinder.z_max for cylinder in self.cylinders[:-1]])
+        return np.searchsorted(edges, z, side="right")
+
+    def _get_by_belts(self, method_name, x, y, z):
+        belts = self.get_belt_indices(z)
+        if np.ndim(belts) == 0:
+            return getattr(self.cylinders[belts], method_name)(x, y, z)
+        x, y, z = np.asarray(x), np.asarray(y), np.asarray(z)
+        result = np.empty(len(z), dtype=np.float64)
+        for idx, cylinder in enumerate(self.cylinders):
+            mask = belts == idx
+            result[mask] = getattr(cylinder, method_name)(x[mask], y[mask], z[mask])
+        return result
+
+    def get_radial_distance(self, x, y, z):
+        return self._get_by_belts("get_radial_distance", x, y, z)
+
+    def get_deviation(self, x, y, z):
+        return self._get_by_belts("get_deviation", x, y, z)
+
+    @staticmethod
+    def detect_belt_edges(scan: Scan, slice_height=0.1, radius_jump=0.005, min_belt_height=1.0):
+        x, y, z = scan.x, scan.y, scan.z
+        z_min, z_max = scan.stats.z.min, scan.stats.z.max
+        count_of_slices = max(1, int(np.ceil((z_max - z_min) / slice_height)))
+        slices = np.minimum(((z - z_min) / slice_height).astype(np.intp), count_of_slices - 1)
+        u, v = x - scan.stats.x.mean, y - scan.stats.y.mean
+        w = u ** 2 + v ** 2
+        sums = [np.bincount(slices, weights=value, minlength=count_of_slices)
+                for value in (u * u, u * v, u, v * v, v, np.ones_like(u), u * w, v * w, w)]
+        suu, suv, su, svv, sv, sn, suw, svw, sw = sums
+        n = np.stack([np.stack([suu, suv, su], axis=-1),
+                      np.stack([suv, svv, sv], axis=-1),
+                      np.stack([su, sv, sn], axis=-1)], axis=-2)
+        b = np.stack([suw, svw, sw], axis=-1)
+        # Срезы с вырожденной системой (точки на одной прямой или совпадают) пропускаются
+        filled = sn >= 3
+        filled[filled] = np.linalg.cond(n[filled]) < 1e12
+        if not filled.any():
+            return [z_min, z_max]
+        a_c, b_c, c = np.linalg.solve(n[filled], b[filled][..., None])[..., 0].T
+        radii = np.sqrt(c + (a_c / 2) ** 2 + (b_c / 2) ** 2)
+        slice_z = z_min + (np.flatnonzero(filled) + 0.5) * slice_height
+        edges = [z_min]
+        belt_radius = radii[0]
+        for slice_idx in range(1, len(radii)):
+            if (abs(radii[slice_idx] - belt_radius) > radius_jump
+                    and slice_z[slice_idx] - slice_height / 2 - edges[-1] >= min_belt_height):
+                edges.append(float(slice_z[slice_idx] - slice_height / 2))
+                belt_radius = radii[slice_idx]
+            else:
+                belt_radius = np.median(radii[max(0, slice_idx - 10):slice_idx + 1])
+        if z_max - edges[-1] < min_belt_height and len(edges) > 1:
+            edges.pop()
+        edges.append(z_max)
+        return edges
+
+    @classmethod
+    def best_fit_stacked_cylinder_in_scan(cls, scan: Scan, belt_edges=None, processes=None,
+                                          max_iteration=50, max_tolerance=1e-4, **detect_kwargs):
+        if belt_edges is None:
+            belt_edges = cls.detect_belt_edges(scan, **detect_kwargs)
+        belt_edges = np.asarray(belt_edges, dtype=np.float64)
+        belts = np.searchsorted(belt_edges[1:-1], scan.z, side="right")
+        inside = (scan.z >= belt_edges[0]) & (scan.z <= belt_edges[-1])
+        order = np.flatnonzero(inside)[np.argsort(belts[inside], kind="stable")]
+        bounds = np.searchsorted(belts[order], np.arange(len(belt_edges)))
+        belts_to_fit = [(idx, start, stop) for idx, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+        for idx, start, stop in belts_to_fit:
+            if stop - start < 3:
+                raise ValueError(f"В поясе {idx} ({belt_edges[idx]} - {belt_edges[idx + 1]}) "
+                                 f"меньше трёх точек ({stop - start}), окружность не может быть вписана!")
+        shm = shared_memory.SharedMemory(create=True, size=max(1, 3 * len(order) * 8))
+        coords = None
+        try:
+            coords = np.ndarray((3, len(order)), dtype=np.float64, buffer=shm.buf)
+            np.take(scan.x, order, out=coords[0])
+            np.take(scan.y, order, out=coords[1])
+            np.take(scan.z, order, out=coords[2])
+            if processes == 1:
+                results = [_fit_belt_circle(coords[0, start:stop], coords[1, start:stop], max_iteration, max_tolerance)
+                           for _, start, stop in belts_to_fit]
+            else:
+                with ProcessPoolExecutor(max_workers=processes, initializer=_init_belt_worker,
+                                         initargs=(shm.name, len(order))) as executor:
+                    futures = [executor.submit(_fit_belt, start, stop, max_iteration, max_tolerance)
+                               for _, start, stop in belts_to_fit]
+                    results = [future.result() for future in futures]
+        finally:
+            coords = None
+            shm.close()
+            shm.unlink()
+        cylinders = [Cylinder(circle=Circle(x0=x0, y0=y0, r=r),
+                              z_min=float(belt_edges[idx]),
+                              z_max=float(belt_edges[idx + 1]),
+                              )
+                     for (x0, y0, r), (idx, _, _) in zip(results, belts_to_fit)]
+        return cls(cylinders)
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class CylindricalProjection:
+
+    def __init__(self, cylinder):
+        self.cylinder = cylinder
+        self.axis, self.e1, self.e2 = self.get_axis_frame(cylinder.tilt_x, cylinder.tilt_y)
+        self.origin = np.array([cylinder.x0, cylinder.y0, cylinder.z0])
+
+    @staticmethod
+    def get_axis_frame(tilt_x=0.0, tilt_y=0.0):
+        axis = np.array([tilt_x, tilt_y, 1.0])
+        axis /= np.linalg.norm(axis)
+        e1 = np.array([1.0, 0.0, 0.0]) - axis[0] * axis
+        e1 /= np.linalg.norm(e1)
+        e2 = np.cross(axis, e1)
+        return axis, e1, e2
+
+    def to_cylindrical(self, x, y, z):
+        wx, wy, wz = x - self.origin[0], y - self.origin[1], z - self.origin[2]
+        h = wx * self.axis[0] + wy * self.axis[1] + wz * self.axis[2]
+        u = wx * self.e1[0] + wy * self.e1[1] + wz * self.e1[2]
+        v = wx * self.e2[0] + wy * self.e2[1] + wz * self.e2[2]
+        azimuth = np.mod(np.arctan2(v, u), 2 * np.pi)
+        return self.origin[2] + h, azimuth, np.hypot(u, v)
+
+    def from_cylindrical(self, h, azimuth, radius):
+        h = np.asarray(h) - self.origin[2]
+        cos_a, sin_a = radius * np.cos(azimuth), radius * np.sin(azimuth)
+        x = self.origin[0] + h * self.axis[0] + cos_a * self.e1[0] + sin_a * self.e2[0]
+        y = self.origin[1] + h * self.axis[1] + cos_a * self.e1[1] + sin_a * self.e2[1]
+        z = self.origin[2] + h * self.axis[2] + cos_a * self.e1[2] + sin_a * self.e2[2]
+        return x, y, z
+
+    def to_flat(self, x, y, z):
+        h, azimuth, radius = self.to_cylindrical(x, y, z)
+        return h, self.cylinder.r * azimuth, radius - self.cylinder.r
+
+    def from_flat(self, h, arc, deformation=0.0, def_scale=1):
+        return self.from_cylindrical(h, np.asarray(arc) / self.cylinder.r,
+                                     self.cylinder.r + np.asarray(deformation) * def_scale)
@@ -21,10 +21,7 @@ class CylinderDeformationCalculator(DeformationCalculatorABC):
         self.cylinder = cylinder
 
     def calculate(self, def_scan):
-        for point in def_scan:
-            self.calculate_deformation(point)
+        def_scan.deformation[:] = self.cylinder.get_deviation(def_scan.x, def_scan.y, def_scan.z)
 
     def calculate_deformation(self, point):
-        point_r = ((point.x - self.cylinder.x0) ** 2 + (point.y - self.cylinder.y0) ** 2) ** 0.5
-        deformation = point_r - self.cylinder.circle.r
-        point.deformation = deformation
+        point.deformation = float(self.cylinder.get_deviation(point.x, point.y, point.z))
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class DeformationRaster:
+
+    def __init__(self, values, x_min, y_min, dx, dy):
+        self.values = values
+        self.x_min = x_min
+        self.y_min = y_min
+        self.dx = dx
+        self.dy = dy
+
+    def __str__(self):
+        return (f"{self.__class__.__name__} (shape={self.values.shape}, "
+                f"x=[{self.x_min:.3f}-{self.x_max:.3f}], y=[{self.y_min:.3f}-{self.y_max:.3f}])")
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def x_max(self):
+        return self.x_min + (self.shape[1] - 1) * self.dx
+
+    @property
+    def y_max(self):
+        return self.y_min + (self.shape[0] - 1) * self.dy
+
+    @property
+    def x_coords(self):
+        return self.x_min + np.arange(self.shape[1]) * self.dx
+
+    @property
+    def y_coords(self):
+        return self.y_min + np.arange(self.shape[0]) * self.dy
+
+    @staticmethod
+    def _get_cell(coords, coord_min, step, size):
+        position = np.clip((coords - coord_min) / step, 0, size - 1)
+        idx = np.minimum(position.astype(np.intp), size - 2)
+        return idx, position - idx
+
+    def sample(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        j, tx = self._get_cell(x, self.x_min, self.dx, self.shape[1])
+        i, ty = self._get_cell(y, self.y_min, self.dy, self.shape[0])
+        v = self.values
+        return ((1 - tx) * (1 - ty) * v[i, j] + tx * (1 - ty) * v[i, j + 1]
+                + (1 - tx) * ty * v[i + 1, j] + tx * ty * v[i + 1, j + 1])
+
+    @classmethod
+    def create_from_interpolator(cls, interpolator, x_min, x_max, y_min, y_max, resolution=(100, 1000)):
+        nx, ny = resolution
+        x_grid, y_grid = np.meshgrid(np.linspace(x_min, x_max, nx), np.linspace(y_min, y_max, ny))
+        values = interpolator(x_grid, y_grid)
+        return cls(values=values, x_min=x_min, y_min=y_min,
+                   dx=(x_max - x_min) / (nx - 1), dy=(y_max - y_min) / (ny - 1))
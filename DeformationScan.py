@@ -1,55 +1,97 @@
-from Points import DeformationPoint
+import numpy as np
+
+from Points import DeformationPoint, DeformationPointView
 from Scan import Scan
+from ScanStats import ScanStats
 
 
 class DeformationScan(Scan):
 
+    _columns_spec = {**Scan._columns_spec,
+                     "deformation": (np.float64, ()),
+                     }
+    _point_view_cls = DeformationPointView
+    def_percentiles = (1, 5, 50, 95, 99)
+
     def __init__(self, scan_name):
         super().__init__(scan_name)
         self.min_deformation = None
         self.max_deformation = None
         self.mse = None
+        self.percentiles = {}
 
     def __str__(self):
         s_str = super().__str__()
         return (f"{s_str}\b\b def_limits=[({self.min_deformation:.3f})-({self.max_deformation:.3f})]_"
                 f"def_mse={self.mse:.3f}")
 
+    @property
+    def deformation(self):
+        return self._columns["deformation"][:self._len]
+
     def add_point(self, point):
         if isinstance(point, DeformationPoint):
-            self._points.append(point)
-            self.borders = self._check_border(borders_dict=self.borders, point=point)
+            super().add_point(point)
         else:
             d_point = DeformationPoint.create_def_point_from_point(point)
             self.add_point(d_point)
 
-    def _calk_def_limits(self):
-        def_lst = []
-        for point in self:
-            def_lst.append(point.deformation)
-        self.min_deformation = min(def_lst)
-        self.max_deformation = max(def_lst)
-
-    def _calk_def_mse(self):
-        vv = []
-        for point in self:
-            vv.append(point.deformation ** 2)
-        sum_vv = sum(vv)
-        mse = (sum_vv / len(vv)) ** 0.5
-        self.mse = mse
+    def _set_point_extra_columns(self, idx, point):
+        deformation = point.deformation
+        self._columns["deformation"][idx] = np.nan if deformation is None else deformation
+
+    def _get_bin_attrs(self):
+        return {"min_deformation": self.min_deformation,
+                "max_deformation": self.max_deformation,
+                "mse": self.mse,
+                "percentiles": list(self.percentiles.items()),
+                }
+
+    def _set_bin_attrs(self, attrs):
+        self.min_deformation = attrs.get("min_deformation")
+        self.max_deformation = attrs.get("max_deformation")
+        self.mse = attrs.get("mse")
+        self.percentiles = dict(attrs.get("percentiles", []))
+
+    def _calk_def_stats(self):
+        deformation = self.deformation
+        if self._stats is not None:
+            self._stats.reset_column("deformation", deformation)
+        stats = self.stats.deformation
+        if stats.count == 0:
+            return
+        self.min_deformation = stats.min
+        self.max_deformation = stats.max
+        self.mse = stats.rms
+        if stats.count < len(deformation):
+            deformation = deformation[~np.isnan(deformation)]
+        levels = np.percentile(deformation, self.def_percentiles)
+        self.percentiles = dict(zip(self.def_percentiles, map(float, levels)))
+
+    def filter_scan(self, *args, **kwargs):
+        f_scan = super().filter_scan(*args, **kwargs)
+        if isinstance(f_scan, DeformationScan):
+            f_scan._calk_def_stats()
+        return f_scan
 
     @classmethod
     def create_def_scan_from_scan(cls, scan: Scan):
         def_scan = cls(scan_name=scan.name)
-        for point in scan:
-            def_scan.add_point(point)
+        # Колонки координат и цвета - представления колонок исходного скана, без копирования
+        columns = {name: column[:len(scan)] for name, column in scan._columns.items()
+                   if name in def_scan._columns_spec}
+        columns["deformation"] = np.full(len(scan), np.nan)
+        def_scan._set_columns(columns)
+        def_scan.borders = dict(scan.borders)
+        if scan._stats is not None:
+            def_scan._stats = ScanStats(ScanStats.get_stats_columns(def_scan)).merge(scan._stats)
         return def_scan
 
     def calculate_deformation(self, deformation_calculator, *args, **kwargs):
         deformation_calculator = deformation_calculator(*args, **kwargs)
         deformation_calculator.calculate(def_scan=self)
-        self._calk_def_limits()
-        self._calk_def_mse()
+        self._points_changed()
+        self._calk_def_stats()
 
 
 
@@ -0,0 +1,100 @@
+import re
+
+import numpy as np
+
+
+class StreamingDxfWriter:
+
+    _invalid_layer_chars = re.compile(r"[^A-Za-z0-9_$-]")
+
+    def __init__(self, file_path, layers=(), precision=6, buffer_size=4 * 2 ** 20):
+        self.file_path = file_path
+        self.layers = [self.get_layer_name(layer) for layer in layers]
+        self.precision = precision
+        self.buffer_size = buffer_size
+        self._file = None
+        self._count_of_entities = 0
+
+    def __enter__(self):
+        self._file = open(self.file_path, "w", encoding="ascii", buffering=self.buffer_size, newline="\n")
+        self._write_header()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.write("0\nENDSEC\n0\nEOF\n")
+        self._file.close()
+        self._file = None
+
+    @classmethod
+    def get_layer_name(cls, name):
+        if isinstance(name, float):
+            # Округление + 0.0 убирает "-0.0000" у уровней, сдвинутых np.arange от нуля
+            name = f"{round(name, 4) + 0.0:.4f}".replace("-", "M").replace(".", "_")
+        return cls._invalid_layer_chars.sub("_", str(name))
+
+    def _write_header(self):
+        write = self._file.write
+        write("0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1009\n0\nENDSEC\n")
+        write("0\nSECTION\n2\nTABLES\n")
+        write("0\nTABLE\n2\nLTYPE\n70\n1\n"
+              "0\nLTYPE\n2\nCONTINUOUS\n70\n0\n3\nSolid line\n72\n65\n73\n0\n40\n0.0\n0\nENDTAB\n")
+        layers = ["0"] + [layer for layer in dict.fromkeys(self.layers) if layer != "0"]
+        write(f"0\nTABLE\n2\nLAYER\n70\n{len(layers)}\n")
+        for layer in layers:
+            write(f"0\nLAYER\n2\n{layer}\n70\n0\n62\n7\n6\nCONTINUOUS\n")
+        write("0\nENDTAB\n0\nENDSEC\n")
+        write("0\nSECTION\n2\nENTITIES\n")
+
+    def add_polyline(self, points, layer="0", elevation=0.0, closed=False):
+        points = np.asarray(points, dtype=np.float64)
+        layer = self.get_layer_name(layer)
+        is_3d = points.shape[1] == 3
+        if closed is None:
+            closed = len(points) > 2 and np.array_equal(points[0], points[-1])
+        flags = (8 if is_3d else 0) | (1 if closed else 0)
+        p = self.precision
+        self._file.write(f"0\nPOLYLINE\n8\n{layer}\n66\n1\n10\n0.0\n20\n0.0\n30\n{0.0 if is_3d else elevation:.{p}f}\n"
+                         f"70\n{flags}\n")
+        if is_3d:
+            vertex = f"0\nVERTEX\n8\n{layer}\n10\n%.{p}f\n20\n%.{p}f\n30\n%.{p}f\n70\n32\n"
+        else:
+            vertex = f"0\nVERTEX\n8\n{layer}\n10\n%.{p}f\n20\n%.{p}f\n30\n0.0\n"
+        self._file.write(vertex * len(points) % tuple(points.ravel().tolist()))
+        self._file.write(f"0\nSEQEND\n8\n{layer}\n")
+        self._count_of_entities += 1
+
+    def add_polylines(self, polylines, layer="0", elevation=0.0, closed=False):
+        for points in polylines:
+            self.add_polyline(points, layer=layer, elevation=elevation, closed=closed)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+
+    import ezdxf
+
+    rng = np.random.default_rng(0)
+    levels = np.round(np.arange(-0.05, 0.05, 0.001), 4)
+    polylines = {level: [np.cumsum(rng.normal(size=(200, 2)), axis=0) for _ in range(20)] for level in levels}
+    count = sum(len(lines) for lines in polylines.values())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t0 = time.perf_counter()
+        doc = ezdxf.new("R2010")
+        msp = doc.modelspace()
+        for level, lines in polylines.items():
+            for line in lines:
+                msp.add_lwpolyline(line, format="xy", dxfattribs={"elevation": level})
+        doc.saveas(os.path.join(tmp_dir, "ezdxf.dxf"))
+        print(f"ezdxf:     {time.perf_counter() - t0:.2f} s for {count} polylines")
+
+        t0 = time.perf_counter()
+        with StreamingDxfWriter(os.path.join(tmp_dir, "stream.dxf"), layers=levels.tolist()) as writer:
+            for level, lines in polylines.items():
+                writer.add_polylines(lines, layer=float(level), elevation=level)
+        print(f"streaming: {time.perf_counter() - t0:.2f} s for {count} polylines")
+
+        doc = ezdxf.readfile(os.path.join(tmp_dir, "stream.dxf"))
+        print(f"read back: {len(doc.modelspace())} entities, {len(doc.layers)} layers")
@@ -2,140 +2,192 @@ import math
 
 import ezdxf
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy.interpolate import Rbf
 
+from Circle import Circle
+from ContourExtractor import MarchingSquares
 from Cylinder import Cylinder
+from DeformationRaster import DeformationRaster
 from DeformationScan import DeformationScan
-from Points import DeformationPoint
+from DxfWriter import StreamingDxfWriter
+from Interpolators import InterpolatorCache, LocalRbfInterpolator
 
 
 class FlatDeformationScan(DeformationScan):
 
-    def __init__(self, scan_name, def_scale=1, rbf_function="linear"):
+    def __init__(self, scan_name, def_scale=1, rbf_function="linear", interpolator=LocalRbfInterpolator,
+                 interpolators_cache_bytes=512 * 2 ** 20, raster_resolution=(100, 1000)):
         super().__init__(scan_name)
         self.def_scale = def_scale
         self.function = rbf_function
+        self.interpolator = interpolator
         self.base_scan = None
         self.cylinder = None
-        self.rbf = None
+        self.interpolators = InterpolatorCache(max_bytes=interpolators_cache_bytes)
+        self.raster_resolution = raster_resolution
+        self._rasters = {}
 
     def __str__(self):
         return (f"{self.__class__.__name__} (scan_name={self.name}, "
                 f"num_of_point={len(self)}, borders={self.borders})")
 
-    def get_rbf(self, function=None):
-        def get_points_lists(scan):
-            x, y, z = [], [], []
-            for point in scan:
-                x.append(point.x)
-                y.append(point.y)
-                z.append(point.z)
-            return x, y, z
-
-        if self.rbf is None and function is None:
-            self.rbf = Rbf(*get_points_lists(self), function=self.function)
-            return self.rbf
-        elif self.rbf is not None and (function is None or function==self.function):
-            return self.rbf
-        else:
-            return Rbf(*get_points_lists(self), function=function)
-
-    def get_flat_contours(self, levels_step=0.01, function="linear", def_scale=1):
+    def _get_bin_attrs(self):
+        attrs = super()._get_bin_attrs()
+        attrs["def_scale"] = self.def_scale
+        attrs["function"] = self.function
+        if self.cylinder is not None:
+            attrs["cylinder"] = {"x0": self.cylinder.x0,
+                                 "y0": self.cylinder.y0,
+                                 "r": self.cylinder.r,
+                                 "z_min": self.cylinder.z_min,
+                                 "z_max": self.cylinder.z_max,
+                                 "tilt_x": self.cylinder.tilt_x,
+                                 "tilt_y": self.cylinder.tilt_y,
+                                 "z0": self.cylinder.z0,
+                                 }
+        return attrs
+
+    def _set_bin_attrs(self, attrs):
+        super()._set_bin_attrs(attrs)
+        self.def_scale = attrs.get("def_scale", self.def_scale)
+        self.function = attrs.get("function", self.function)
+        cylinder = attrs.get("cylinder")
+        if cylinder is not None:
+            self.cylinder = Cylinder(circle=Circle(x0=cylinder["x0"], y0=cylinder["y0"], r=cylinder["r"]),
+                                     z_min=cylinder["z_min"],
+                                     z_max=cylinder["z_max"],
+                                     tilt_x=cylinder.get("tilt_x", 0.0),
+                                     tilt_y=cylinder.get("tilt_y", 0.0),
+                                     z0=cylinder.get("z0"),
+                                     )
+
+    def _copy_attrs_to(self, scan):
+        super()._copy_attrs_to(scan)
+        scan.cylinder = self.cylinder
+        scan.base_scan = self.base_scan
+        scan.interpolator = self.interpolator
+        scan.raster_resolution = self.raster_resolution
+        scan.interpolators.max_bytes = self.interpolators.max_bytes
+
+    def _points_changed(self):
+        super()._points_changed()
+        if hasattr(self, "interpolators"):
+            self.interpolators.clear()
+            self._rasters.clear()
+
+    def _get_function_key(self, function):
+        # Функция входит в ключи кэшей только для интерполяторов, которые её используют
+        return function if self.interpolator.uses_function else None
+
+    def get_rbf(self, function=None, smoothing=0):
+        if function is None:
+            function = self.function
+        key = (self.interpolator.__name__, self._get_function_key(function), smoothing, self._version)
+        return self.interpolators.get(key, lambda: self.interpolator(self.x, self.y, self.z,
+                                                                     function=function,
+                                                                     smoothing=smoothing))
+
+    def get_deformation_raster(self, function=None, resolution=None):
+        if function is None:
+            function = self.function
+        if resolution is None:
+            resolution = self.raster_resolution
+        key = (self.interpolator.__name__, self._get_function_key(function), tuple(resolution), self._version)
+        if key not in self._rasters:
+            self._rasters[key] = DeformationRaster.create_from_interpolator(self.get_rbf(function=function),
+                                                                            x_min=self.borders["x_min"],
+                                                                            x_max=self.borders["x_max"],
+                                                                            y_min=0,
+                                                                            y_max=self.borders["y_max"],
+                                                                            resolution=resolution)
+        return self._rasters[key]
+
+    def _get_contour_levels(self, levels_step):
         levels_0 = self.borders["z_min"] - math.fmod(self.borders["z_min"], levels_step)
-        levels = np.arange(levels_0, self.borders["z_max"], levels_step)
-        rbf = self.get_rbf(function=function)
-        x_grid, y_grid = np.meshgrid(np.linspace(0, self.borders["y_max"], 1000),
-                                     np.linspace(self.borders["x_min"], self.borders["x_max"], 100))
-        z_grid = rbf(y_grid, x_grid)
-        z_grid *= def_scale
-        contours = plt.contour(x_grid, y_grid, z_grid, levels=levels, colors='black')
-        contours_dict = {}
-        for idx, contour in enumerate(contours.collections):
-            contours_dict[levels[idx]] = contour
-        return contours_dict
-
-    def get_circular_sections(self, levels_step=0.01, function="linear", def_scale=None):
+        return np.arange(levels_0, self.borders["z_max"], levels_step)
+
+    def _get_contour_extractor(self, function=None, def_scale=1):
+        raster = self.get_deformation_raster(function=function)
+        return MarchingSquares(x_coords=raster.y_coords, y_coords=raster.x_coords,
+                               values=raster.values.T * def_scale)
+
+    def get_flat_contours(self, levels_step=0.01, function=None, def_scale=1, processes=1):
+        extractor = self._get_contour_extractor(function=function, def_scale=def_scale)
+        return extractor.get_contours(self._get_contour_levels(levels_step), processes=processes)
+
+    def get_circular_sections(self, levels_step=0.01, function=None, def_scale=None, processes=1):
         if def_scale is None:
             def_scale = self.def_scale
-        flat_contours = self.get_flat_contours(levels_step=levels_step, function=function)
+        flat_contours = self.get_flat_contours(levels_step=levels_step, function=function, processes=processes)
+        projection = self.cylinder.get_projection()
         contours = {}
-        for level, collection in flat_contours.items():
-            for path in collection.get_paths():
-                segments = path.to_polygons()
-                for idx, segment in enumerate(segments):
-                    x_coords = segment[:-1, 0]
-                    y_coords = segment[:-1, 1]
-                    z_coords = np.full_like(x_coords, level)
-                    for idx in range(len(x_coords)):
-                        azimuth = x_coords[idx] / self.cylinder.r
-                        r = self.cylinder.r + z_coords[idx] * def_scale
-                        z_coords[idx] = y_coords[idx]
-                        x_coords[idx] = self.cylinder.x0 + r * math.cos(azimuth)
-                        y_coords[idx] = self.cylinder.y0 + r * math.sin(azimuth)
-                    contours[f"{level}_{idx}"] = [x_coords, y_coords, z_coords]
+        for level, polylines in flat_contours.items():
+            for idx, polyline in enumerate(polylines):
+                contours[f"{level:.4f}_{idx}"] = list(projection.from_flat(polyline[:, 1], polyline[:, 0],
+                                                                           level, def_scale=def_scale))
         return contours
 
-    def save_flat_contours_to_dxf(self, levels_step=0.01, file_path='contours.dxf', function="linear"):
-        contours = self.get_flat_contours(levels_step=levels_step, function=function)
+    def save_flat_contours_to_dxf(self, levels_step=0.01, file_path='contours.dxf', function=None, processes=1,
+                                  streaming=True):
+        levels = self._get_contour_levels(levels_step)
+        contours = self._get_contour_extractor(function=function).iter_contours(levels, processes=processes)
+        if streaming:
+            with StreamingDxfWriter(file_path, layers=[float(level) for level in levels]) as writer:
+                for level, polylines in contours:
+                    writer.add_polylines(polylines, layer=float(level), elevation=level)
+            return
         doc = ezdxf.new('R2010')
         msp = doc.modelspace()
-        for level, collection in contours.items():
-            for path in collection.get_paths():
-                segments = path.to_polygons()
-                for segment in segments:
-                    x_coords = segment[:-1, 0]
-                    y_coords = segment[:-1, 1]
-                    z_coords = np.full_like(x_coords, level)
-                    msp.add_lwpolyline(list(zip(x_coords, y_coords, z_coords)),
-                                       dxfattribs={'elevation': z_coords[0]})
+        for level, polylines in contours:
+            for polyline in polylines:
+                msp.add_lwpolyline(polyline, format="xy", dxfattribs={'elevation': level})
         doc.saveas(file_path)
 
     @staticmethod
-    def save_sections_to_dxf(sections_dict, file_path='section.dxf'):
+    def save_sections_to_dxf(sections_dict, file_path='section.dxf', streaming=True):
+        if streaming:
+            # Ключи круговых сечений имеют вид "<уровень>_<номер>" - все линии уровня кладём в один слой,
+            # имя которого совпадает со слоем изолиний того же уровня
+            layers = {level: float(level.rsplit("_", 1)[0]) if isinstance(level, str) else float(level)
+                      for level in sections_dict}
+            with StreamingDxfWriter(file_path, layers=layers.values()) as writer:
+                for level, section in sections_dict.items():
+                    writer.add_polyline(np.column_stack(section[:3]), layer=layers[level])
+            return
         doc = ezdxf.new('R2010')
         msp = doc.modelspace()
         for level, section in sections_dict.items():
             msp.add_polyline3d(list(zip(section[0], section[1], section[2])))
         doc.saveas(file_path)
 
-    def get_horizontal_section(self, z0, z_max, levels_step, count_of_segments=100, function="linear", def_scale=None):
+    def get_horizontal_section(self, z0, z_max, levels_step, count_of_segments=100, function=None, def_scale=None):
         if def_scale is None:
             def_scale = self.def_scale
-        rbf = self.get_rbf(function=function)
+        raster = self.get_deformation_raster(function=function)
+        projection = self.cylinder.get_projection()
         contours = {}
         sec_elevations = np.arange(z0, z_max + 1e-5, levels_step)
         for sec_elev in sec_elevations:
             x_grid = np.linspace(self.borders["y_min"], self.borders["y_max"], count_of_segments+1)
             y_grid = np.full_like(x_grid, sec_elev)
-            z_grid = rbf(y_grid, x_grid)
-            for idx in range(count_of_segments+1):
-                azimuth = x_grid[idx] / self.cylinder.r
-                r = self.cylinder.r + z_grid[idx] * def_scale
-                z_grid[idx] = y_grid[idx]
-                x_grid[idx] = self.cylinder.x0 + r * math.cos(azimuth)
-                y_grid[idx] = self.cylinder.y0 + r * math.sin(azimuth)
+            z_grid = raster.sample(y_grid, x_grid)
+            x_grid, y_grid, z_grid = projection.from_flat(y_grid, x_grid, z_grid, def_scale=def_scale)
             contours[sec_elev] = [x_grid, y_grid, z_grid]
         return contours
 
     def get_vertical_section(self, start_azimuth=0, end_azimuth=360, count_of_section=8,
-                             count_of_segments=100, function="linear", def_scale=None):
+                             count_of_segments=100, function=None, def_scale=None):
         if def_scale is None:
             def_scale = self.def_scale
-        rbf = self.get_rbf(function=function)
+        raster = self.get_deformation_raster(function=function)
+        projection = self.cylinder.get_projection()
         contours = {}
         sec_angels = np.linspace(start_azimuth, end_azimuth, count_of_section+1)[:-1]
         for sec_angle in sec_angels:
             y_grid = np.linspace(self.borders["x_min"], self.borders["x_max"], count_of_segments+1)
             l = self.cylinder.r * math.radians(sec_angle)
             x_grid = np.full_like(y_grid, l)
-            z_grid = rbf(y_grid, x_grid)
-            for idx in range(count_of_segments+1):
-                azimuth = x_grid[idx] / self.cylinder.r
-                r = self.cylinder.r + z_grid[idx] * def_scale
-                z_grid[idx] = y_grid[idx]
-                x_grid[idx] = self.cylinder.x0 + r * math.cos(azimuth)
-                y_grid[idx] = self.cylinder.y0 + r * math.sin(azimuth)
+            z_grid = raster.sample(y_grid, x_grid)
+            x_grid, y_grid, z_grid = projection.from_flat(y_grid, x_grid, z_grid, def_scale=def_scale)
             contours[sec_angle] = [x_grid, y_grid, z_grid]
         return contours
 
@@ -145,15 +197,33 @@ class FlatDeformationScan(DeformationScan):
         flat_def_scan = cls(scan_name=f"Flat_DS_{def_scan.name}")
         flat_def_scan.base_scan = def_scan
         flat_def_scan.cylinder = cylinder
-        for point in def_scan:
-            azimuth = math.atan2(point.y - cylinder.y0,
-                                 point.x - cylinder.x0)
-            if azimuth < 0:
-                azimuth += 2 * math.pi
-            x = point.z
-            y = cylinder.circle.r * azimuth
-            z = point.deformation
-            new_point = DeformationPoint(x=float(x), y=float(y), z=float(z), color=point.color)
-            new_point.deformation = point.deformation
-            flat_def_scan.add_point(new_point)
+        x, y, _ = cylinder.get_projection().to_flat(def_scan.x, def_scan.y, def_scan.z)
+        flat_def_scan.add_points(x, y, def_scan.deformation, color=def_scan.color, deformation=def_scan.deformation)
+        return flat_def_scan
+
+    @classmethod
+    def create_flat_def_scan_from_def_chunks(cls, def_chunks, cylinder: Cylinder, scan_name, cell_size=0.05):
+        # Развертка по блокам в сетку фиксированного размера: в каждой ячейке (высота, дуга)
+        # копятся суммы координат и деформаций, поэтому память не зависит от числа точек
+        projection = cylinder.get_projection()
+        h_min = cylinder.z_min
+        count_h = max(1, math.ceil((cylinder.z_max - cylinder.z_min) / cell_size))
+        count_arc = max(1, math.ceil(2 * math.pi * cylinder.r / cell_size))
+        sums = np.zeros((4, count_h * count_arc))
+        for def_chunk in def_chunks:
+            h, arc, _ = projection.to_flat(def_chunk.x, def_chunk.y, def_chunk.z)
+            deformation = def_chunk.deformation
+            valid = ~np.isnan(deformation)
+            h, arc, deformation = h[valid], arc[valid], deformation[valid]
+            idx_h = np.clip(((h - h_min) / cell_size).astype(np.int64), 0, count_h - 1)
+            idx_arc = np.clip((arc / cell_size).astype(np.int64), 0, count_arc - 1)
+            cells = idx_h * count_arc + idx_arc
+            for row, values in enumerate((h, arc, deformation, None)):
+                sums[row] += np.bincount(cells, weights=values, minlength=sums.shape[1])
+        occupied = sums[3] > 0
+        h, arc, deformation = sums[:3, occupied] / sums[3, occupied]
+        flat_def_scan = cls(scan_name=scan_name)
+        flat_def_scan.cylinder = cylinder
+        flat_def_scan.add_points(h, arc, deformation, deformation=deformation)
+        flat_def_scan._calk_def_stats()
         return flat_def_scan
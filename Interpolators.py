@@ -0,0 +1,197 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator, RBFInterpolator, Rbf
+from scipy.spatial import cKDTree
+
+
+class InterpolatorABC(ABC):
+
+    # Зависит ли интерполятор от параметра function (ядра RBF)
+    uses_function = False
+
+    def __init__(self, x, y, z, function="linear", smoothing=0, chunk_size=50_000):
+        self.function = function
+        self.smoothing = smoothing
+        self.chunk_size = chunk_size
+        self.points = np.column_stack((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
+        self.values = np.asarray(z, dtype=np.float64)
+
+    def __call__(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        xy = np.column_stack((x.ravel(), y.ravel()))
+        result = np.empty(len(xy), dtype=np.float64)
+        for start in range(0, len(xy), self.chunk_size):
+            stop = start + self.chunk_size
+            result[start:stop] = self._evaluate(xy[start:stop])
+        return result.reshape(x.shape)
+
+    @abstractmethod
+    def _evaluate(self, xy):
+        pass
+
+    @property
+    def nbytes(self):
+        # Собственные массивы интерполятора; память структур scipy добавляют наследники
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        return sum(array.nbytes for array in arrays)
+
+    @staticmethod
+    def _get_tree_nbytes(tree):
+        # Точки и перестановка индексов + узлы дерева (~72 байта на узел в ckdtree)
+        if tree is None:
+            return 0
+        return tree.data.nbytes + tree.indices.nbytes + 72 * tree.size
+
+    def _get_epsilon(self):
+        edges = np.ptp(self.points, axis=0)
+        edges = edges[edges > 0]
+        if len(edges) == 0:
+            return 1.0
+        return float((np.prod(edges) / len(self.points)) ** (1 / len(edges)))
+
+
+class GlobalRbfInterpolator(InterpolatorABC):
+
+    uses_function = True
+
+    def __init__(self, x, y, z, function="linear", smoothing=0, chunk_size=50_000):
+        super().__init__(x, y, z, function=function, smoothing=smoothing, chunk_size=chunk_size)
+        self.rbf = Rbf(self.points[:, 0], self.points[:, 1], self.values, function=function, smooth=smoothing)
+
+    @property
+    def nbytes(self):
+        # Копии узлов и значений внутри Rbf; матрица расстояний N x N после построения не хранится
+        return super().nbytes + self.rbf.xi.nbytes + self.rbf.di.nbytes + self.rbf.nodes.nbytes
+
+    def _evaluate(self, xy):
+        return self.rbf(xy[:, 0], xy[:, 1])
+
+
+class LocalRbfInterpolator(InterpolatorABC):
+
+    uses_function = True
+
+    # Соответствие имён функций scipy.interpolate.Rbf ядрам RBFInterpolator
+    kernels = {"multiquadric": "multiquadric",
+               "inverse": "inverse_multiquadric",
+               "gaussian": "gaussian",
+               "linear": "linear",
+               "cubic": "cubic",
+               "quintic": "quintic",
+               "thin_plate": "thin_plate_spline",
+               }
+
+    def __init__(self, x, y, z, function="linear", smoothing=0, chunk_size=10_000, neighbors=20):
+        super().__init__(x, y, z, function=function, smoothing=smoothing, chunk_size=chunk_size)
+        kernel = self.kernels.get(function, function)
+        self.rbf = RBFInterpolator(self.points, self.values,
+                                   neighbors=min(neighbors, len(self.values)),
+                                   kernel=kernel,
+                                   epsilon=self._get_epsilon(),
+                                   smoothing=smoothing)
+
+    @property
+    def nbytes(self):
+        # Дерево соседей + системы (neighbors + полином) x (neighbors + полином),
+        # которые RBFInterpolator собирает на каждый блок из chunk_size точек
+        size = self.rbf.neighbors + len(self.rbf.powers)
+        return super().nbytes + self._get_tree_nbytes(self.rbf._tree) + self.chunk_size * size ** 2 * 8
+
+    def _evaluate(self, xy):
+        return self.rbf(xy)
+
+
+class LinearDelaunayInterpolator(InterpolatorABC):
+
+    def __init__(self, x, y, z, function="linear", smoothing=0, chunk_size=200_000):
+        super().__init__(x, y, z, function=function, smoothing=smoothing, chunk_size=chunk_size)
+        self.linear = LinearNDInterpolator(self.points, self.values)
+        self.tree = None
+
+    @property
+    def nbytes(self):
+        # Симплексы, соседи и уравнения граней триангуляции + аффинные преобразования симплексов,
+        # которые find_simplex строит при первом вызове
+        tri = self.linear.tri
+        transform_nbytes = len(tri.simplices) * (tri.ndim + 1) * tri.ndim * 8
+        return (super().nbytes + tri.simplices.nbytes + tri.neighbors.nbytes + tri.equations.nbytes
+                + transform_nbytes + self._get_tree_nbytes(self.tree))
+
+    def _evaluate(self, xy):
+        result = self.linear(xy)
+        outside = np.isnan(result)
+        if outside.any():
+            if self.tree is None:
+                self.tree = cKDTree(self.points)
+            result[outside] = self.values[self.tree.query(xy[outside])[1]]
+        return result
+
+
+class GridIdwInterpolator(InterpolatorABC):
+
+    def __init__(self, x, y, z, function="linear", smoothing=0, chunk_size=200_000,
+                 cell_size=None, neighbors=8, power=2):
+        super().__init__(x, y, z, function=function, smoothing=smoothing, chunk_size=chunk_size)
+        self.neighbors = neighbors
+        self.power = power
+        if cell_size is None:
+            cell_size = 2 * self._get_epsilon()
+        xy_min = self.points.min(axis=0)
+        cells = np.floor((self.points - xy_min) / cell_size).astype(np.int64)
+        shape = cells.max(axis=0) + 1
+        keys = np.ravel_multi_index(cells.T, shape)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse)
+        self.cell_points = np.column_stack([np.bincount(inverse, weights=self.points[:, i]) / counts
+                                            for i in range(2)])
+        self.cell_values = np.bincount(inverse, weights=self.values) / counts
+        self.tree = cKDTree(self.cell_points)
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self._get_tree_nbytes(self.tree)
+
+    def _evaluate(self, xy):
+        k = min(self.neighbors, len(self.cell_values))
+        distance, idx = self.tree.query(xy, k=k)
+        if k == 1:
+            distance, idx = distance[:, None], idx[:, None]
+        weights = 1 / np.maximum(distance, 1e-12) ** self.power
+        return (weights * self.cell_values[idx]).sum(axis=1) / weights.sum(axis=1)
+
+
+class InterpolatorCache:
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._interpolators = OrderedDict()
+
+    def __len__(self):
+        return len(self._interpolators)
+
+    def __str__(self):
+        return (f"{self.__class__.__name__} (count={len(self)}, nbytes={self.nbytes}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+    @property
+    def nbytes(self):
+        return sum(interpolator.nbytes for interpolator in self._interpolators.values())
+
+    def get(self, key, factory):
+        if key in self._interpolators:
+            self.hits += 1
+            self._interpolators.move_to_end(key)
+            return self._interpolators[key]
+        self.misses += 1
+        interpolator = factory()
+        self._interpolators[key] = interpolator
+        while len(self._interpolators) > 1 and self.nbytes > self.max_bytes:
+            self._interpolators.popitem(last=False)
+        return interpolator
+
+    def clear(self):
+        self._interpolators.clear()
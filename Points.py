@@ -1,38 +1,58 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 
 class PointsABC(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def __init__(self, x, y, z=0):
         self.x = x
         self.y = y
         self.z = z
 
+    @staticmethod
+    def check_coordinates(coord):
+        if type(coord) is float:
+            return coord
+        if isinstance(coord, (int, np.integer, np.floating)) and not isinstance(coord, bool):
+            return float(coord)
+        raise ValueError(f"Координата - {coord} - не число ({type(coord)})!")
 
-class Point(PointsABC):
+    @staticmethod
+    def check_coordinates_array(coords):
+        # Пакетная проверка для колонок координат вместо проверки каждой точки
+        coords = np.asarray(coords)
+        if coords.dtype.kind not in "iuf":
+            raise ValueError(f"Координаты должны быть числами, передан массив типа {coords.dtype}!")
+        return coords.astype(np.float64, copy=False)
 
-    def __init__(self, x, y, z):
-        self.x = self.check_coordinates(x)
-        self.y = self.check_coordinates(y)
-        self.z = self.check_coordinates(z)
 
-    def check_coordinates(self, coord):
-        if type(coord) == int:
-            return float(coord)
-        elif type(coord) == float:
-            return coord
-        else:
-            raise ValueError(f"Координата - {coord} - не число ({type(coord)})!")
+class Point(PointsABC):
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z, validate=True):
+        if validate:
+            x, y, z = self.check_coordinates(x), self.check_coordinates(y), self.check_coordinates(z)
+        self.x = x
+        self.y = y
+        self.z = z
 
     def __str__(self):
         return f"Point (x={self.x}, y={self.y}, z={self.z})"
 
 
 class NamedPoint(PointsABC):
-    _names = []
+    __slots__ = ("x", "y", "z", "name")
+    _names = set()
 
-    def __init__(self, x, y, z, name=None):
-        self.point = Point(x=x, y=y, z=z)
+    def __init__(self, x, y, z, name=None, validate=True):
+        if validate:
+            x, y, z = self.check_coordinates(x), self.check_coordinates(y), self.check_coordinates(z)
+        self.x = x
+        self.y = y
+        self.z = z
         self.name = self._check_name(name)
 
     def _check_name(self, name):
@@ -42,61 +62,43 @@ class NamedPoint(PointsABC):
             if name in self._names:
                 raise ValueError("Точка с таким иенем уже есть!")
             else:
-                self._names.append(name)
+                self._names.add(name)
                 return name
 
-    @property
-    def x(self):
-        return self.point.x
-
-    @property
-    def y(self):
-        return self.point.y
-
-    @property
-    def z(self):
-        return self.point.z
-
     def __str__(self):
         if self.name is None:
-            return str(self.point)
+            return f"Point (x={self.x}, y={self.y}, z={self.z})"
         return f"NamedPoint (name={self.name}, x={self.x}, y={self.y}, z={self.z})"
 
 
 class ScanPoint(PointsABC):
+    __slots__ = ("x", "y", "z", "color")
 
-    def __init__(self, x, y, z, color=(0, 0, 0)):
-        self.point = Point(x=x, y=y, z=z)
+    def __init__(self, x, y, z, color=(0, 0, 0), validate=True):
+        if validate:
+            x, y, z = self.check_coordinates(x), self.check_coordinates(y), self.check_coordinates(z)
+        self.x = x
+        self.y = y
+        self.z = z
         self.color = color
 
-    @property
-    def x(self):
-        return self.point.x
-
-    @property
-    def y(self):
-        return self.point.y
-
-    @property
-    def z(self):
-        return self.point.z
-
     def __str__(self):
         return f"ScanPoint (x={self.x}, y={self.y}, z={self.z}, color={self.color})"
 
 
 class DeformationPoint(ScanPoint):
+    __slots__ = ("deformation",)
 
-    def __init__(self, x, y, z, color=(0, 0, 0)):
-        super().__init__(x, y, z, color)
+    def __init__(self, x, y, z, color=(0, 0, 0), validate=True):
+        super().__init__(x, y, z, color, validate=validate)
         self.deformation = None
 
     @classmethod
     def create_def_point_from_point(cls, point: PointsABC):
         if isinstance(point, ScanPoint):
-            return cls(x=point.x, y=point.y, z=point.z, color=point.color)
+            return cls(x=point.x, y=point.y, z=point.z, color=point.color, validate=False)
         elif isinstance(point, PointsABC):
-            return cls(x=point.x, y=point.y, z=point.z)
+            return cls(x=point.x, y=point.y, z=point.z, validate=False)
         else:
             raise ValueError(f"Должен быть объект класса Point, передан {point.__class__}")
 
@@ -106,6 +108,56 @@ class DeformationPoint(ScanPoint):
                 f"color={self.color})")
 
 
+class PointView:
+    # Точка-представление строки колоночного хранилища скана: атрибуты читаются из колонок
+    __slots__ = ()
+
+    @property
+    def x(self):
+        return float(self.scan.x[self.idx])
+
+    @property
+    def y(self):
+        return float(self.scan.y[self.idx])
+
+    @property
+    def z(self):
+        return float(self.scan.z[self.idx])
+
+    @property
+    def color(self):
+        return self.scan.color[self.idx]
+
+    @color.setter
+    def color(self, value):
+        self.scan.color[self.idx] = value
+
+
+class ScanPointView(PointView, ScanPoint):
+    __slots__ = ("scan", "idx")
+
+    def __init__(self, scan, idx):
+        self.scan = scan
+        self.idx = idx
+
+
+class DeformationPointView(PointView, DeformationPoint):
+    __slots__ = ("scan", "idx")
+
+    def __init__(self, scan, idx):
+        self.scan = scan
+        self.idx = idx
+
+    @property
+    def deformation(self):
+        deformation = float(self.scan.deformation[self.idx])
+        return None if deformation != deformation else deformation
+
+    @deformation.setter
+    def deformation(self, value):
+        self.scan.deformation[self.idx] = np.nan if value is None else value
+
+
 if __name__ == "__main__":
 
     p1 = Point(12, 20, 30.6)
@@ -120,3 +172,81 @@ if __name__ == "__main__":
 
     for point in [p1, np1, np2, sp1]:
         print(isinstance(point, PointsABC), point)
+
+    print("*" * 50)
+
+    import time
+
+    class LegacyPoint:
+
+        def __init__(self, x, y, z):
+            self.x = self.check_coordinates(x)
+            self.y = self.check_coordinates(y)
+            self.z = self.check_coordinates(z)
+
+        def check_coordinates(self, coord):
+            if type(coord) == int:
+                return float(coord)
+            elif type(coord) == float:
+                return coord
+            else:
+                raise ValueError(f"Координата - {coord} - не число ({type(coord)})!")
+
+    class LegacyScanPoint:
+
+        def __init__(self, x, y, z, color=(0, 0, 0)):
+            self.point = LegacyPoint(x=x, y=y, z=z)
+            self.color = color
+
+        @property
+        def x(self):
+            return self.point.x
+
+        @property
+        def y(self):
+            return self.point.y
+
+        @property
+        def z(self):
+            return self.point.z
+
+    class LegacyNamedPoint(LegacyScanPoint):
+        _names = []
+
+        def __init__(self, x, y, z, name):
+            super().__init__(x, y, z)
+            if name in self._names:
+                raise ValueError("Точка с таким иенем уже есть!")
+            self._names.append(name)
+            self.name = name
+
+    count = 200_000
+    coords = [(float(i), float(i + 1), float(i + 2)) for i in range(count)]
+
+    def bench(title, create, **kwargs):
+        t0 = time.perf_counter()
+        points = [create(*xyz, **kwargs) for xyz in coords]
+        t1 = time.perf_counter()
+        total = sum(p.x + p.y + p.z for p in points)
+        t2 = time.perf_counter()
+        print(f"{title:<36} create {t1 - t0:6.3f} s  access {t2 - t1:6.3f} s  ({total:.0f})")
+
+    bench("legacy ScanPoint", LegacyScanPoint)
+    bench("ScanPoint (validate=True)", ScanPoint, validate=True)
+    bench("ScanPoint (validate=False)", ScanPoint, validate=False)
+
+    count_of_names = 20_000
+    t0 = time.perf_counter()
+    for i in range(count_of_names):
+        LegacyNamedPoint(0.0, 0.0, 0.0, name=f"legacy_{i}")
+    t1 = time.perf_counter()
+    for i in range(count_of_names):
+        NamedPoint(0.0, 0.0, 0.0, name=f"bench_{i}")
+    t2 = time.perf_counter()
+    print(f"{count_of_names} named points: legacy list {t1 - t0:6.3f} s, set {t2 - t1:6.3f} s")
+
+    import sys
+    legacy_point = LegacyScanPoint(1.0, 2.0, 3.0)
+    legacy_size = sum(sys.getsizeof(obj) for obj in (legacy_point, legacy_point.__dict__,
+                                                      legacy_point.point, legacy_point.point.__dict__))
+    print(f"point size: legacy {legacy_size} B, ScanPoint {sys.getsizeof(ScanPoint(1.0, 2.0, 3.0))} B")
@@ -1,14 +1,31 @@
-from Points import ScanPoint
+import numpy as np
+
+from Points import PointView, ScanPoint, ScanPointView
+from ScanBinFormat import ScanBinFile
 from ScanExporters import ScanExportersToTxt
-from ScanParsers import ScanParserFormTxt
+from ScanParsers import ScanParserFormTxtBulk
 from ScanPlotters import ScanPlotterMPL
+from ScanSpatialIndex import ScanSpatialIndex
+from ScanStats import ScanStats
 
 
 class Scan:
 
+    # Колонки хранилища точек: имя -> (dtype, форма одной записи)
+    _columns_spec = {"x": (np.float64, ()),
+                     "y": (np.float64, ()),
+                     "z": (np.float64, ()),
+                     "color": (np.uint8, (3,)),
+                     }
+    _point_view_cls = ScanPointView
+
     def __init__(self, scan_name: str):
         self.name = scan_name
-        self._points = []
+        self._len = 0
+        self._version = 0
+        self._spatial_index = None
+        self._columns = {name: np.empty((0, *shape), dtype=dtype)
+                         for name, (dtype, shape) in self._columns_spec.items()}
         self.borders = {"x_min": None,
                         "x_max": None,
                         "y_min": None,
@@ -16,40 +33,203 @@ class Scan:
                         "z_min": None,
                         "z_max": None,
                         }
+        # Статистика колонок: поддерживается при добавлении точек,
+        # после замены колонок пересчитывается лениво при первом обращении
+        self._stats = ScanStats(ScanStats.get_stats_columns(self))
 
     def __len__(self):
-        return len(self._points)
+        return self._len
 
     def __iter__(self):
-        return iter(self._points)
+        view_cls = self._point_view_cls
+        for idx in range(self._len):
+            yield view_cls(self, idx)
 
     def __str__(self):
         return f"{self.__class__.__name__} (scan_name={self.name}, num_of_point={len(self)}, borders={self.borders})"
 
+    @property
+    def stats(self):
+        if self._stats is None:
+            self._stats = ScanStats.create_from_scan(self)
+        return self._stats
+
+    @property
+    def x(self):
+        return self._columns["x"][:self._len]
+
+    @property
+    def y(self):
+        return self._columns["y"][:self._len]
+
+    @property
+    def z(self):
+        return self._columns["z"][:self._len]
+
+    @property
+    def color(self):
+        return self._columns["color"][:self._len]
+
     def add_point(self, point):
         if isinstance(point, ScanPoint):
-            self._points.append(point)
-            self.borders = self._check_border(borders_dict=self.borders, point=point)
+            self._reserve(self._len + 1)
+            idx = self._len
+            self._columns["x"][idx] = point.x
+            self._columns["y"][idx] = point.y
+            self._columns["z"][idx] = point.z
+            self._columns["color"][idx] = (0, 0, 0) if point.color is None else point.color
+            self._set_point_extra_columns(idx, point)
+            self._len += 1
+            if self._stats is not None:
+                self._stats.add_point(point)
+                self.borders = self._stats.get_borders()
+            else:
+                self.borders = self._check_border(borders_dict=self.borders, point=point)
+            self._points_changed()
 
-    def load_points_from_file(self, file_path, parser=ScanParserFormTxt):
-        parser = parser(file_path)
+    def _points_changed(self):
+        self._version += 1
+        self._spatial_index = None
+
+    def get_spatial_index(self):
+        if self._spatial_index is None or self._spatial_index.version != self._version:
+            self._spatial_index = ScanSpatialIndex(self)
+        return self._spatial_index
+
+    def query_box(self, **bounds):
+        return self.get_spatial_index().query_box(**bounds)
+
+    def query_radius(self, center, radius):
+        return self.get_spatial_index().query_radius(center, radius)
+
+    def k_nearest(self, point, k=1):
+        return self.get_spatial_index().k_nearest(point, k)
+
+    def _set_point_extra_columns(self, idx, point):
+        pass
+
+    def add_points(self, x, y, z, color=None, stats=None, **columns):
+        x, y, z = (ScanPoint.check_coordinates_array(coords) for coords in (x, y, z))
+        count = len(x)
+        if count == 0:
+            return
+        start, stop = self._len, self._len + count
+        self._reserve(stop)
+        self._columns["x"][start:stop] = x
+        self._columns["y"][start:stop] = y
+        self._columns["z"][start:stop] = z
+        self._columns["color"][start:stop] = 0 if color is None else color
+        for name, column in self._columns.items():
+            if name in ("x", "y", "z", "color"):
+                continue
+            column[start:stop] = columns.get(name, np.nan)
+        self._len = stop
+        # Статистику добавляемых точек (по всем колонкам или их части) можно передать готовой,
+        # если она уже посчитана при чтении - пересчитываются только недостающие колонки
+        new_stats = ScanStats(())
+        if stats is not None:
+            new_stats.merge(stats)
+        for name in ScanStats.get_stats_columns(self):
+            if name not in new_stats.columns:
+                new_stats.reset_column(name, self._columns[name][start:stop])
+        if self._stats is not None:
+            self._stats.merge(new_stats)
+        self.borders = self._merge_borders(self.borders, new_stats.get_borders())
+        self._points_changed()
+
+    def _reserve(self, size):
+        capacity = len(self._columns["x"])
+        if size <= capacity:
+            return
+        new_capacity = max(size, 2 * capacity, 1024)
+        for name, column in self._columns.items():
+            new_column = np.empty((new_capacity, *column.shape[1:]), dtype=column.dtype)
+            new_column[:self._len] = column[:self._len]
+            self._columns[name] = new_column
+
+    def _set_columns(self, columns):
+        self._columns = {name: np.ascontiguousarray(column) for name, column in columns.items()}
+        self._len = len(self._columns["x"])
+        self._stats = None
+        self._points_changed()
+
+    def _take(self, indices):
+        return {name: column[:self._len][indices] for name, column in self._columns.items()}
+
+    def _get_point_indices(self, points_lst):
+        indices = np.empty(len(points_lst), dtype=np.intp)
+        for i, point in enumerate(points_lst):
+            if not (isinstance(point, PointView) and point.scan is self):
+                return None
+            indices[i] = point.idx
+        return indices
+
+    def _get_columns_from_points(self, points_lst):
+        f_scan = self.__class__(scan_name=self.name)
+        for point in points_lst:
+            f_scan.add_point(point)
+        return f_scan._take(slice(None))
+
+    def load_points_from_file(self, file_path, parser=ScanParserFormTxtBulk, **kwargs):
+        parser = parser(file_path, **kwargs)
         parser.parse(scan=self)
 
+    @classmethod
+    def load_scan_from_bin(cls, file_path):
+        bin_file = ScanBinFile(file_path)
+        header = bin_file.read_header()
+        columns = bin_file.read_columns(header)
+        scan = cls(scan_name=header["name"])
+        for name, (dtype, shape) in scan._columns_spec.items():
+            if name not in columns:
+                columns[name] = np.full((header["count"], *shape), np.nan if name != "color" else 0, dtype=dtype)
+        scan._set_columns({name: columns[name] for name in scan._columns_spec})
+        scan.borders = header["borders"]
+        scan._set_bin_attrs(header["attrs"])
+        return scan
+
+    def _get_bin_attrs(self):
+        return {}
+
+    def _set_bin_attrs(self, attrs):
+        pass
+
+    def _copy_attrs_to(self, scan):
+        # Атрибуты подкласса, которые переходят в отфильтрованную копию скана
+        scan._set_bin_attrs(self._get_bin_attrs())
+
     def export_points_from_file(self, file_path, parser=ScanExportersToTxt):
         parser = parser(file_path)
         parser.export(scan=self)
 
-    def filter_scan(self, filter_cls, *args, replace_points_in_scan=True, **kwargs):
+    def filter_scan(self, filter_cls, *args, replace_points_in_scan=True, return_indices=False, **kwargs):
         filter = filter_cls(*args, **kwargs)
         filtered_points = filter.filter(scan=self)
+        if isinstance(filtered_points, dict):
+            # Фильтр сам сформировал новые колонки (например, прореживание с усреднением)
+            indices = None
+            columns = filtered_points
+        elif isinstance(filtered_points, np.ndarray):
+            indices = filtered_points
+        else:
+            indices = self._get_point_indices(filtered_points)
+        if return_indices:
+            if indices is None:
+                raise TypeError(f"Фильтр {filter_cls.__name__} не отбирает точки этого скана "
+                                f"и не может вернуть их индексы!")
+            return np.flatnonzero(indices) if indices.dtype == bool else indices
+        if indices is not None:
+            columns = self._take(indices)
+        elif not isinstance(filtered_points, dict):
+            columns = self._get_columns_from_points(filtered_points)
         if replace_points_in_scan:
-            self._points = filtered_points
             f_scan = self
         else:
             f_scan_name = f"{self.name}_filtered"
-            f_scan = Scan(scan_name=f_scan_name)
-            f_scan._points = filtered_points
-        f_scan.borders = self._get_borders_dict(f_scan._points)
+            f_scan = self.__class__(scan_name=f_scan_name)
+            self._copy_attrs_to(f_scan)
+        f_scan._set_columns(columns)
+        f_scan.borders = f_scan.stats.get_borders()
         return f_scan
 
     def plot(self, *args, plotter=ScanPlotterMPL, **kwargs):
@@ -80,25 +260,36 @@ class Scan:
             borders_dict["z_max"] = point.z
         return borders_dict
 
-    def _get_borders_dict(self, points_lst):
+    def _calc_borders(self, start=0, stop=None):
         borders = {"x_min": None, "x_max": None,
                    "y_min": None, "y_max": None,
                    "z_min": None, "z_max": None,
                    }
-        for point in points_lst:
-            borders = self._check_border(borders_dict=borders,
-                                         point=point)
+        stop = self._len if stop is None else stop
+        if stop <= start:
+            return borders
+        for axis in ("x", "y", "z"):
+            column = self._columns[axis][start:stop]
+            borders[f"{axis}_min"] = float(column.min())
+            borders[f"{axis}_max"] = float(column.max())
         return borders
 
+    @staticmethod
+    def _merge_borders(borders_dict, other_borders):
+        if borders_dict["x_min"] is None:
+            return dict(other_borders)
+        if other_borders["x_min"] is None:
+            return borders_dict
+        return {key: (min if key.endswith("_min") else max)(value, other_borders[key])
+                for key, value in borders_dict.items()}
 
 
 if __name__ == "__main__":
     scan = Scan("Scan1")
     print(scan)
-    scan.load_points_from_file(file_path=r"src/SKLD.txt", parser=ScanParserFormTxt)
+    scan.load_points_from_file(file_path=r"src/SKLD.txt", parser=ScanParserFormTxtBulk)
     print(scan)
 
     scan.plot()
     # for point in scan:
     #      print(point)
-
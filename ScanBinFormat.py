@@ -0,0 +1,69 @@
+import json
+import struct
+
+import numpy as np
+
+
+class ScanBinFile:
+
+    magic = b"OTASCAN1"
+    alignment = 64
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    @classmethod
+    def _align(cls, position):
+        return -(-position // cls.alignment) * cls.alignment
+
+    def write(self, scan):
+        columns = {name: np.ascontiguousarray(column[:len(scan)]) for name, column in scan._columns.items()}
+        header = {"class": scan.__class__.__name__,
+                  "name": scan.name,
+                  "count": len(scan),
+                  "borders": scan.borders,
+                  "attrs": scan._get_bin_attrs(),
+                  "columns": [],
+                  }
+        position = 0
+        for name, column in columns.items():
+            header["columns"].append({"name": name,
+                                      "dtype": column.dtype.str,
+                                      "shape": list(column.shape),
+                                      "offset": position,
+                                      })
+            position = self._align(position + column.nbytes)
+        header_bytes = json.dumps(header).encode("UTF-8")
+        data_start = self._get_data_start(len(header_bytes))
+        with open(self.file_path, "wb") as file:
+            file.write(self.magic)
+            file.write(struct.pack("<Q", len(header_bytes)))
+            file.write(header_bytes)
+            for column_info, column in zip(header["columns"], columns.values()):
+                file.write(b"\0" * (data_start + column_info["offset"] - file.tell()))
+                column.tofile(file)
+
+    @classmethod
+    def _get_data_start(cls, header_length):
+        return cls._align(len(cls.magic) + 8 + header_length)
+
+    def read_header(self):
+        with open(self.file_path, "rb") as file:
+            if file.read(len(self.magic)) != self.magic:
+                raise ValueError(f"Файл {self.file_path} не является бинарным файлом скана!")
+            header_length, = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(header_length).decode("UTF-8"))
+        header["data_start"] = self._get_data_start(header_length)
+        return header
+
+    def read_columns(self, header, mode="c"):
+        columns = {}
+        for column_info in header["columns"]:
+            shape = tuple(column_info["shape"])
+            if shape[0] == 0:
+                columns[column_info["name"]] = np.empty(shape, dtype=column_info["dtype"])
+                continue
+            columns[column_info["name"]] = np.memmap(self.file_path, dtype=column_info["dtype"], mode=mode,
+                                                     offset=header["data_start"] + column_info["offset"],
+                                                     shape=shape)
+        return columns
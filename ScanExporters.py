@@ -1,15 +1,124 @@
+import numpy as np
+
+from ScanBinFormat import ScanBinFile
 
 
 class ScanExportersToTxt:
 
+    def __init__(self, file_path, precision=6, chunk_size=100_000, buffer_size=4 * 2 ** 20):
+        self.file_path = file_path
+        self.precision = precision
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+
+    def export(self, scan):
+        p = self.precision
+        row = f"%.{p}f %.{p}f %.{p}f %d %d %d\n"
+        x, y, z, color = scan.x, scan.y, scan.z, scan.color
+        with open(self.file_path, "w", encoding="UTF-8", buffering=self.buffer_size, newline="\n") as file:
+            for start in range(0, len(scan), self.chunk_size):
+                stop = min(start + self.chunk_size, len(scan))
+                # Весь блок форматируется одной операцией по шаблону из повторенных строк
+                block = np.column_stack((x[start:stop], y[start:stop], z[start:stop], color[start:stop]))
+                file.write((row * (stop - start)) % tuple(block.ravel().tolist()))
+
+
+class ScanExportersToBin:
+
     def __init__(self, file_path):
         self.file_path = file_path
 
     def export(self, scan):
-        with open(self.file_path, "w", encoding="UTF-8") as file:
+        ScanBinFile(self.file_path).write(scan)
+
+
+class ScanExportersToPly:
+
+    # Бинарный PLY (little-endian): координаты, цвет и прочие колонки скана
+    # (например, деформации) как скалярные свойства вершин
+
+    _ply_types = {np.dtype(np.float64): "double",
+                  np.dtype(np.float32): "float",
+                  np.dtype(np.uint8): "uchar",
+                  np.dtype(np.int32): "int",
+                  }
+
+    def __init__(self, file_path, chunk_size=1_000_000, scalar_dtype=np.float32):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.scalar_dtype = np.dtype(scalar_dtype)
+
+    def _get_vertex_dtype(self, scan):
+        fields = [("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("red", "u1"), ("green", "u1"), ("blue", "u1")]
+        for name, column in scan._columns.items():
+            if name in ("x", "y", "z", "color"):
+                continue
+            if column.ndim != 1:
+                raise ValueError(f"Колонка {name} не может быть записана в PLY как скалярное свойство!")
+            fields.append((name, self.scalar_dtype.newbyteorder("<")))
+        return np.dtype(fields)
+
+    def _get_header(self, scan, vertex_dtype):
+        lines = ["ply",
+                 "format binary_little_endian 1.0",
+                 f"comment {scan.__class__.__name__} {scan.name}",
+                 f"element vertex {len(scan)}",
+                 ]
+        for name in vertex_dtype.names:
+            ply_type = self._ply_types[vertex_dtype[name].newbyteorder("=")]
+            lines.append(f"property {ply_type} {name}")
+        lines.append("end_header")
+        return ("\n".join(lines) + "\n").encode("ascii")
+
+    def export(self, scan):
+        vertex_dtype = self._get_vertex_dtype(scan)
+        columns = {name: getattr(scan, name) for name in vertex_dtype.names if name in scan._columns}
+        with open(self.file_path, "wb") as file:
+            file.write(self._get_header(scan, vertex_dtype))
+            for start in range(0, len(scan), self.chunk_size):
+                stop = min(start + self.chunk_size, len(scan))
+                vertices = np.empty(stop - start, dtype=vertex_dtype)
+                for name, column in columns.items():
+                    vertices[name] = column[start:stop]
+                for idx, name in enumerate(("red", "green", "blue")):
+                    vertices[name] = scan.color[start:stop, idx]
+                vertices.tofile(file)
+
+
+if __name__ == "__main__":
+    import os
+    import time
+
+    from DeformationScan import DeformationScan
+    from ScanFilters import ScanFilterFromMask
+
+    def legacy_export(scan, file_path):
+        with open(file_path, "w", encoding="UTF-8") as file:
             for point in scan:
                 if point.color is None:
                     point_str = f"{point.x} {point.y} {point.z}\n"
                 else:
                     point_str = f"{point.x} {point.y} {point.z} {point.color[0]} {point.color[1]} {point.color[2]}\n"
-                file.write(point_str)
\ No newline at end of file
+                file.write(point_str)
+
+    rng = np.random.default_rng(0)
+    count = 1_000_000
+    scan = DeformationScan("Bench")
+    azimuth = rng.uniform(0, 2 * np.pi, count)
+    scan.add_points(1344089.5 + 22.8 * np.cos(azimuth), 489107.5 + 22.8 * np.sin(azimuth),
+                    rng.uniform(0, 10, count), color=rng.integers(0, 256, (count, 3)),
+                    deformation=rng.normal(0, 0.01, count))
+
+    count_legacy = 100_000
+    legacy_scan = scan.filter_scan(ScanFilterFromMask, replace_points_in_scan=False, mask=np.arange(count_legacy))
+    t0 = time.perf_counter()
+    legacy_export(legacy_scan, "bench_legacy.txt")
+    print(f"legacy txt (extrapolated to {count} pts): {(time.perf_counter() - t0) * count / count_legacy:.2f} s")
+
+    for exporter, file_path in [(ScanExportersToTxt, "bench.txt"), (ScanExportersToPly, "bench.ply")]:
+        t0 = time.perf_counter()
+        scan.export_points_from_file(file_path, parser=exporter)
+        print(f"{exporter.__name__:<20} {time.perf_counter() - t0:8.2f} s  {os.path.getsize(file_path) / 2 ** 20:8.1f} MB")
+
+    for file_path in ["bench_legacy.txt", "bench.txt", "bench.ply"]:
+        os.remove(file_path)
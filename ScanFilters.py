@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 
 class ScanFilterABC(ABC):
 
@@ -8,9 +10,52 @@ class ScanFilterABC(ABC):
         pass
 
     @abstractmethod
-    def filter(self, scan):
+    def get_mask(self, scan):
         pass
 
+    def filter(self, scan):
+        return self.get_mask(scan)
+
+
+class ScanColumnsSubset:
+
+    def __init__(self, scan, indices):
+        self.scan = scan
+        self.indices = indices
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self.scan._columns:
+            raise AttributeError(name)
+        if name not in self._columns:
+            self._columns[name] = getattr(self.scan, name)[self.indices]
+        return self._columns[name]
+
+
+class ScanFilterPipeline(ScanFilterABC):
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def get_indices(self, scan):
+        indices = None
+        for scan_filter in self.filters:
+            subset = scan if indices is None else ScanColumnsSubset(scan, indices)
+            mask = scan_filter.get_mask(subset)
+            indices = np.flatnonzero(mask) if indices is None else indices[mask]
+        return np.arange(len(scan)) if indices is None else indices
+
+    def get_mask(self, scan):
+        mask = np.zeros(len(scan), dtype=bool)
+        mask[self.get_indices(scan)] = True
+        return mask
+
+    def filter(self, scan):
+        return self.get_indices(scan)
+
 
 class ScanDelimiter(ScanFilterABC):
 
@@ -18,13 +63,108 @@ class ScanDelimiter(ScanFilterABC):
         self.delimiter = delimiter
         self.counter = 0
 
+    def get_mask(self, scan):
+        mask = (np.arange(len(scan)) + self.counter) % self.delimiter == 0
+        self.counter += len(scan)
+        return mask
+
+
+class ScanFilterVoxelGrid(ScanFilterABC):
+    # Прореживание по сетке вокселей: одна точка на непустую ячейку.
+    # method="centroid" - среднее точек ячейки, method="nearest" - ближайшая к среднему точка.
+    # Прочие числовые колонки (деформации) усредняются по ячейке без учета NaN.
+    # cell_size - число или (dx, dy, dz); dz=None - сетка только в плоскости XY
+
+    _methods = ("centroid", "nearest")
+
+    def __init__(self, cell_size, method="centroid", max_dense_cells_ratio=4):
+        if method not in self._methods:
+            raise ValueError(f"Неизвестный метод прореживания {method}! Допустимые: {self._methods}")
+        self.cell_size = (cell_size,) * 3 if np.isscalar(cell_size) else tuple(cell_size)
+        self.method = method
+        self.max_dense_cells_ratio = max_dense_cells_ratio
+
+    def get_cells(self, scan):
+        count = len(scan)
+        cells = np.zeros(count, dtype=np.int64)
+        cells_count = 1
+        for axis, size in zip(("x", "y", "z"), self.cell_size):
+            if size is None or count == 0:
+                continue
+            column = getattr(scan, axis)
+            axis_cells = np.floor((column - column.min()) / size).astype(np.int64)
+            axis_count = int(axis_cells.max()) + 1
+            cells = cells * axis_count + axis_cells
+            cells, cells_count = self._compress_cells(cells, cells_count * axis_count, count)
+        return cells, cells_count
+
+    def _compress_cells(self, cells, cells_range, count):
+        # Перенумерация занятых ячеек подряд после добавления каждой оси
+        if cells_range <= max(self.max_dense_cells_ratio * count, 2 ** 20):
+            # Плотный диапазон номеров - группировка за O(N) через bincount
+            occupied = np.bincount(cells, minlength=cells_range) > 0
+            cell_ids = np.cumsum(occupied) - 1
+            return cell_ids[cells], int(cell_ids[-1]) + 1
+        # Слишком разреженная сетка - группировка сортировкой
+        unique_cells, cells = np.unique(cells, return_inverse=True)
+        return cells.ravel(), len(unique_cells)
+
+    @staticmethod
+    def _get_cells_mean(cells, cells_count, column, counts=None):
+        valid = ~np.isnan(column)
+        if not valid.all():
+            cells, column, counts = cells[valid], column[valid], None
+        sums = np.bincount(cells, weights=column, minlength=cells_count)
+        if counts is None:
+            counts = np.bincount(cells, minlength=cells_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    def _get_nearest_indices(self, scan, cells, cells_count):
+        counts = np.bincount(cells, minlength=cells_count)
+        dist = np.zeros(len(scan))
+        for axis in ("x", "y", "z"):
+            column = getattr(scan, axis)
+            delta = column - self._get_cells_mean(cells, cells_count, column, counts)[cells]
+            dist += delta * delta
+        min_dist = np.full(cells_count, np.inf)
+        np.minimum.at(min_dist, cells, dist)
+        candidates = np.flatnonzero(dist == min_dist[cells])
+        indices = np.empty(cells_count, dtype=np.intp)
+        # При равных расстояниях остается первая по порядку точка ячейки
+        indices[cells[candidates[::-1]]] = candidates[::-1]
+        return np.sort(indices)
+
+    def get_mask(self, scan):
+        mask = np.zeros(len(scan), dtype=bool)
+        if len(scan):
+            mask[self._get_nearest_indices(scan, *self.get_cells(scan))] = True
+        return mask
+
     def filter(self, scan):
-        point_lst = []
-        for point in scan:
-            if self.counter % self.delimiter == 0:
-                point_lst.append(point)
-            self.counter += 1
-        return point_lst
+        if len(scan) == 0:
+            return np.empty(0, dtype=np.intp)
+        cells, cells_count = self.get_cells(scan)
+        counts = np.bincount(cells, minlength=cells_count)
+        if self.method == "nearest":
+            indices = self._get_nearest_indices(scan, cells, cells_count)
+            columns = {name: getattr(scan, name)[indices] for name in scan._columns}
+            representative_cells = cells[indices]
+        else:
+            columns = {}
+            representative_cells = slice(None)
+        for name in scan._columns:
+            column = getattr(scan, name)
+            if self.method == "nearest" and (name in ("x", "y", "z") or column.dtype.kind != "f"):
+                continue
+            if column.dtype.kind == "f":
+                mean = self._get_cells_mean(cells, cells_count, column, counts)
+            else:
+                mean = np.stack([self._get_cells_mean(cells, cells_count, channel.astype(np.float64), counts)
+                                 for channel in column.reshape(len(column), -1).T], axis=-1)
+                mean = np.rint(mean).astype(column.dtype).reshape(cells_count, *column.shape[1:])
+            columns[name] = mean[representative_cells]
+        return columns
 
 
 class ScanFilterFromZminToZmax(ScanFilterABC):
@@ -33,12 +173,8 @@ class ScanFilterFromZminToZmax(ScanFilterABC):
         self.z_min = z_min
         self.z_max = z_max
 
-    def filter(self, scan):
-        point_lst = []
-        for point in scan:
-            if self.z_min < point.z < self.z_max:
-                point_lst.append(point)
-        return point_lst
+    def get_mask(self, scan):
+        return (scan.z > self.z_min) & (scan.z < self.z_max)
 
 
 class ScanFilterFromCylinder(ScanFilterABC):
@@ -49,17 +185,106 @@ class ScanFilterFromCylinder(ScanFilterABC):
         self.only_outside = only_outside
 
     def filtered_function(self, point):
-        point_r = ((point.x - self.cylinder.x0) ** 2 + (point.y - self.cylinder.y0) ** 2) ** 0.5
-        dr = point_r - self.cylinder.circle.r
+        dr = self.cylinder.get_deviation(point.x, point.y, point.z)
         if self.only_outside:
             return dr < self.tolerance
         return abs(dr) < self.tolerance
 
+    def get_mask(self, scan):
+        return self.filtered_function(scan)
+
+
+class ScanFilterFromMask(ScanFilterABC):
+
+    def __init__(self, mask):
+        self.mask = np.asarray(mask)
+
+    def get_mask(self, scan):
+        if self.mask.dtype != bool:
+            mask = np.zeros(len(scan), dtype=bool)
+            mask[self.mask] = True
+            return mask
+        if len(self.mask) != len(scan):
+            raise ValueError(f"Длина маски ({len(self.mask)}) не совпадает с числом точек скана ({len(scan)})!")
+        return self.mask
+
+
+class ScanSpatialFilterABC(ScanFilterABC):
+    # Фильтры по области: на целом скане отвечает пространственный индекс,
+    # на подмножестве точек внутри конвейера - линейная проверка колонок
+
+    def get_mask(self, scan):
+        if not hasattr(scan, "get_spatial_index"):
+            return self.get_linear_mask(scan)
+        mask = np.zeros(len(scan), dtype=bool)
+        mask[self.get_indices(scan.get_spatial_index())] = True
+        return mask
+
     def filter(self, scan):
-        point_lst = []
-        for point in scan:
-            if self.filtered_function((point)):
-                point_lst.append(point)
-        return point_lst
+        if not hasattr(scan, "get_spatial_index"):
+            return self.get_linear_mask(scan)
+        return self.get_indices(scan.get_spatial_index())
+
+    @abstractmethod
+    def get_indices(self, spatial_index):
+        pass
+
+    @abstractmethod
+    def get_linear_mask(self, scan):
+        pass
+
+
+class ScanFilterFromBox(ScanSpatialFilterABC):
+
+    def __init__(self, x_min=None, x_max=None, y_min=None, y_max=None, z_min=None, z_max=None):
+        self.bounds = {"x_min": x_min, "x_max": x_max,
+                       "y_min": y_min, "y_max": y_max,
+                       "z_min": z_min, "z_max": z_max,
+                       }
+
+    def get_indices(self, spatial_index):
+        return spatial_index.query_box(**self.bounds)
+
+    def get_linear_mask(self, scan):
+        mask = np.ones(len(scan), dtype=bool)
+        for axis in ("x", "y", "z"):
+            column = getattr(scan, axis)
+            if self.bounds[f"{axis}_min"] is not None:
+                mask &= column > self.bounds[f"{axis}_min"]
+            if self.bounds[f"{axis}_max"] is not None:
+                mask &= column < self.bounds[f"{axis}_max"]
+        return mask
+
+
+class ScanFilterFromRadius(ScanSpatialFilterABC):
+
+    def __init__(self, center, radius):
+        self.center = np.asarray(center, dtype=np.float64)
+        self.radius = radius
+
+    def get_indices(self, spatial_index):
+        return spatial_index.query_radius(self.center, self.radius)
+
+    def get_linear_mask(self, scan):
+        dx, dy, dz = scan.x - self.center[0], scan.y - self.center[1], scan.z - self.center[2]
+        return dx * dx + dy * dy + dz * dz <= self.radius ** 2
+
+
+class ScanFilterFromNearest(ScanSpatialFilterABC):
+
+    def __init__(self, point, k=1):
+        self.point = np.asarray(point, dtype=np.float64)
+        self.k = k
 
+    def get_indices(self, spatial_index):
+        return np.sort(spatial_index.k_nearest(self.point, self.k)[1])
 
+    def get_linear_mask(self, scan):
+        dx, dy, dz = scan.x - self.point[0], scan.y - self.point[1], scan.z - self.point[2]
+        dist = dx * dx + dy * dy + dz * dz
+        mask = np.zeros(len(scan), dtype=bool)
+        if self.k >= len(scan):
+            mask[:] = True
+        elif self.k > 0:
+            mask[np.argpartition(dist, self.k - 1)[:self.k]] = True
+        return mask
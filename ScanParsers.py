@@ -1,6 +1,14 @@
+import os
+import struct
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
 
 from Points import ScanPoint
+from ScanBinFormat import ScanBinFile
+from ScanStats import ScanStats
 
 
 class ScanParserABC(ABC):
@@ -20,7 +28,7 @@ class ScanParserFormTxt(ScanParserABC):
                 line = line.strip().split()
                 xyz = [float(xyz_) for xyz_ in line[:3]]
                 rgb = list(map(int, line[3:6]))
-                point = ScanPoint(x=xyz[0], y=xyz[1], z=xyz[2], color=rgb)
+                point = ScanPoint(x=xyz[0], y=xyz[1], z=xyz[2], color=rgb, validate=False)
                 scan.add_point(point)
 
 
@@ -31,10 +39,334 @@ class ScanParserFormTxtWithoutColor(ScanParserABC):
                 line = line.strip().split()
                 xyz = [float(xyz_) for xyz_ in line[:3]]
                 rgb = default_color
-                point = ScanPoint(x=xyz[0], y=xyz[1], z=xyz[2], color=rgb)
+                point = ScanPoint(x=xyz[0], y=xyz[1], z=xyz[2], color=rgb, validate=False)
                 scan.add_point(point)
 
 
+class ScanParserFormTxtBulk(ScanParserABC):
+
+    def __init__(self, file_path, use_color=None, chunk_size=1_000_000):
+        super().__init__(file_path)
+        self.use_color = use_color
+        self.chunk_size = chunk_size
+
+    def _detect_color(self, line):
+        return len(line.split()) >= 6
+
+    def _get_line_chunks(self, file):
+        first_line = file.readline()
+        while first_line and not first_line.strip():
+            first_line = file.readline()
+        if not first_line:
+            return
+        use_color = self._detect_color(first_line) if self.use_color is None else self.use_color
+        usecols = (0, 1, 2, 3, 4, 5) if use_color else (0, 1, 2)
+        lines = [first_line]
+        for line in file:
+            lines.append(line)
+            if len(lines) >= self.chunk_size:
+                yield lines, usecols
+                lines = []
+        if lines:
+            yield lines, usecols
+
+    def iter_chunks(self):
+        with open(self.file_path, "rt", encoding="UTF-8") as file:
+            for lines, usecols in self._get_line_chunks(file):
+                data = np.loadtxt(lines, usecols=usecols, ndmin=2)
+                color = data[:, 3:6].astype(np.uint8) if len(usecols) == 6 else None
+                yield data[:, 0], data[:, 1], data[:, 2], color
+
+    def parse(self, scan, default_color=(0, 0, 0)):
+        for x, y, z, color in self.iter_chunks():
+            scan.add_points(x, y, z, color=default_color if color is None else color)
+
+
+_txt_worker_shm = None
+_txt_worker_columns = None
+
+
+def _init_txt_worker(shm_names, count_of_points):
+    global _txt_worker_shm, _txt_worker_columns
+    _txt_worker_shm = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    _txt_worker_columns = (np.ndarray((3, count_of_points), dtype=np.float64, buffer=_txt_worker_shm[0].buf),
+                           np.ndarray((count_of_points, 3), dtype=np.uint8, buffer=_txt_worker_shm[1].buf))
+
+
+def _iter_txt_range_lines(file_path, start, stop, block_size):
+    # Границы диапазона выровнены по переводам строк, поэтому readlines не выходит за stop
+    # (readlines читает строки, пока их суммарная длина не превысит hint)
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        position = start
+        while position < stop:
+            hint = min(block_size, stop - position - 1)
+            lines = file.readlines(hint) if hint > 0 else [file.readline()]
+            if not lines or not lines[-1]:
+                break
+            position += sum(map(len, lines))
+            yield lines
+
+
+def _count_txt_range_lines(file_path, start, stop, block_size):
+    return sum(len(lines) for lines in _iter_txt_range_lines(file_path, start, stop, block_size))
+
+
+def _parse_txt_range(file_path, start, stop, offset, usecols, block_size):
+    xyz, color = _txt_worker_columns
+    count = 0
+    for lines in _iter_txt_range_lines(file_path, start, stop, block_size):
+        data = np.loadtxt(lines, usecols=usecols, ndmin=2)
+        rows = slice(offset + count, offset + count + len(data))
+        xyz[:, rows] = data[:, :3].T
+        if len(usecols) == 6:
+            color[rows] = data[:, 3:6]
+        count += len(data)
+    # Статистика координат диапазона считается здесь же, пока данные в кэше процесса
+    stats = ScanStats(("x", "y", "z"))
+    for axis, row in zip(("x", "y", "z"), xyz[:, offset:offset + count]):
+        stats.update_column(axis, row)
+    return count, stats
+
+
+class ScanParserFormTxtParallel(ScanParserFormTxtBulk):
+
+    def __init__(self, file_path, use_color=None, chunk_size=1_000_000, processes=None, ranges_per_process=4,
+                 block_size=64 * 2 ** 20):
+        super().__init__(file_path, use_color=use_color, chunk_size=chunk_size)
+        self.processes = processes or os.cpu_count() or 1
+        self.ranges_per_process = ranges_per_process
+        self.block_size = block_size
+
+    def get_byte_ranges(self, count_of_ranges):
+        # Делим файл на примерно равные диапазоны байт и сдвигаем границы к началу следующей строки
+        file_size = os.path.getsize(self.file_path)
+        bounds = [0]
+        with open(self.file_path, "rb") as file:
+            for idx in range(1, count_of_ranges):
+                position = max(file_size * idx // count_of_ranges, bounds[-1])
+                if position == 0 or position >= file_size:
+                    continue
+                file.seek(position - 1)
+                file.readline()
+                bounds.append(min(file.tell(), file_size))
+        bounds.append(file_size)
+        return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    def _get_usecols(self):
+        with open(self.file_path, "rt", encoding="UTF-8") as file:
+            for line in file:
+                if line.strip():
+                    use_color = self._detect_color(line) if self.use_color is None else self.use_color
+                    return (0, 1, 2, 3, 4, 5) if use_color else (0, 1, 2)
+        return None
+
+    def parse(self, scan, default_color=(0, 0, 0)):
+        if self.processes == 1:
+            return super().parse(scan, default_color=default_color)
+        usecols = self._get_usecols()
+        if usecols is None:
+            return
+        byte_ranges = self.get_byte_ranges(self.processes * self.ranges_per_process)
+        block_size = min(self.block_size, self.chunk_size * 64)
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            futures = [executor.submit(_count_txt_range_lines, self.file_path, start, stop, block_size)
+                       for start, stop in byte_ranges]
+            counts = [future.result() for future in futures]
+        count_of_points = sum(counts)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        shm_xyz = shared_memory.SharedMemory(create=True, size=max(1, 3 * count_of_points * 8))
+        shm_color = shared_memory.SharedMemory(create=True, size=max(1, 3 * count_of_points))
+        xyz = color = None
+        try:
+            xyz = np.ndarray((3, count_of_points), dtype=np.float64, buffer=shm_xyz.buf)
+            color = np.ndarray((count_of_points, 3), dtype=np.uint8, buffer=shm_color.buf)
+            color[:] = default_color
+            # Каждый процесс пишет свой диапазон сразу на место в общих массивах
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_txt_worker,
+                                     initargs=((shm_xyz.name, shm_color.name), count_of_points)) as executor:
+                futures = [executor.submit(_parse_txt_range, self.file_path, start, stop, int(offset), usecols,
+                                           block_size)
+                           for (start, stop), offset in zip(byte_ranges, offsets)]
+                results = [future.result() for future in futures]
+            stats = ScanStats(("x", "y", "z"))
+            for _, range_stats in results:
+                stats.merge(range_stats)
+            if sum(count for count, _ in results) < count_of_points:
+                # Пустые строки внутри диапазонов - оставляем только разобранные записи
+                keep = np.concatenate([np.arange(offset, offset + count)
+                                       for (count, _), offset in zip(results, offsets)])
+                xyz, color = xyz[:, keep], color[keep]
+            if stats.x.count:
+                scan.add_points(xyz[0], xyz[1], xyz[2], color=color, stats=stats)
+        finally:
+            xyz = color = None
+            shm_xyz.close()
+            shm_xyz.unlink()
+            shm_color.close()
+            shm_color.unlink()
+
+
 class ScanParserFormLaz(ScanParserABC):
-    def parse(self, scan):
-        raise NotImplementedError
+
+    # Смещение RGB в записи точки для форматов LAS, которые хранят цвет
+    _rgb_offsets = {2: 20, 3: 28, 5: 28, 7: 30, 8: 30, 10: 30}
+
+    def __init__(self, file_path, chunk_size=1_000_000, z_min=None, z_max=None, bbox=None):
+        super().__init__(file_path)
+        self.chunk_size = chunk_size
+        self.z_min = z_min
+        self.z_max = z_max
+        self.bbox = bbox
+
+    def read_header(self, file):
+        raw = file.read(375)
+        if raw[:4] != b"LASF":
+            raise ValueError(f"Файл {self.file_path} не является LAS/LAZ файлом!")
+        version = struct.unpack_from("<BB", raw, 24)
+        offset_to_points, = struct.unpack_from("<I", raw, 96)
+        point_format, record_length = struct.unpack_from("<BH", raw, 104)
+        point_count, = struct.unpack_from("<I", raw, 107)
+        scale = struct.unpack_from("<3d", raw, 131)
+        offset = struct.unpack_from("<3d", raw, 155)
+        if version >= (1, 4):
+            point_count_64, = struct.unpack_from("<Q", raw, 247)
+            point_count = point_count_64 or point_count
+        return {"version": version,
+                "offset_to_points": offset_to_points,
+                "point_format": point_format & 0x3F,
+                "compressed": bool(point_format & 0x80),
+                "record_length": record_length,
+                "point_count": point_count,
+                "scale": scale,
+                "offset": offset,
+                }
+
+    def _get_record_dtype(self, header):
+        names, formats, offsets = ["X", "Y", "Z"], ["<i4", "<i4", "<i4"], [0, 4, 8]
+        rgb_offset = self._rgb_offsets.get(header["point_format"])
+        if rgb_offset is not None:
+            names += ["red", "green", "blue"]
+            formats += ["<u2", "<u2", "<u2"]
+            offsets += [rgb_offset, rgb_offset + 2, rgb_offset + 4]
+        return np.dtype({"names": names, "formats": formats, "offsets": offsets,
+                         "itemsize": header["record_length"]})
+
+    def _get_mask(self, x, y, z):
+        mask = np.ones(len(x), dtype=bool)
+        if self.z_min is not None:
+            mask &= z >= self.z_min
+        if self.z_max is not None:
+            mask &= z <= self.z_max
+        if self.bbox is not None:
+            x_min, y_min, x_max, y_max = self.bbox
+            mask &= (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return mask
+
+    @staticmethod
+    def _get_color(red, green, blue):
+        # По спецификации LAS цвет всегда 16-битный - берем старший байт в каждом блоке одинаково
+        rgb = np.column_stack((red, green, blue))
+        return (rgb >> 8).astype(np.uint8)
+
+    def _iter_las_records(self, file, header):
+        dtype = self._get_record_dtype(header)
+        scale, offset = header["scale"], header["offset"]
+        file.seek(header["offset_to_points"])
+        points_left = header["point_count"]
+        while points_left > 0:
+            count = min(self.chunk_size, points_left)
+            buffer = file.read(count * dtype.itemsize)
+            records = np.frombuffer(buffer, dtype=dtype, count=len(buffer) // dtype.itemsize)
+            if len(records) == 0:
+                break
+            points_left -= len(records)
+            x = records["X"] * scale[0] + offset[0]
+            y = records["Y"] * scale[1] + offset[1]
+            z = records["Z"] * scale[2] + offset[2]
+            color = None
+            if "red" in dtype.names:
+                color = self._get_color(records["red"], records["green"], records["blue"])
+            yield x, y, z, color
+
+    def _iter_laz_records(self):
+        try:
+            import laspy
+        except ImportError:
+            raise ImportError("Для чтения LAZ необходим пакет laspy с декомпрессором (lazrs или laszip)!")
+        with laspy.open(self.file_path) as reader:
+            has_color = "red" in reader.header.point_format.dimension_names
+            for points in reader.chunk_iterator(self.chunk_size):
+                color = None
+                if has_color:
+                    color = self._get_color(np.asarray(points.red), np.asarray(points.green),
+                                            np.asarray(points.blue))
+                yield np.asarray(points.x), np.asarray(points.y), np.asarray(points.z), color
+
+    def iter_chunks(self):
+        with open(self.file_path, "rb") as file:
+            header = self.read_header(file)
+            if header["compressed"]:
+                records = self._iter_laz_records()
+            else:
+                records = self._iter_las_records(file, header)
+            for x, y, z, color in records:
+                mask = self._get_mask(x, y, z)
+                if not mask.all():
+                    x, y, z = x[mask], y[mask], z[mask]
+                    color = None if color is None else color[mask]
+                yield x, y, z, color
+
+    def parse(self, scan, default_color=(0, 0, 0)):
+        for x, y, z, color in self.iter_chunks():
+            scan.add_points(x, y, z, color=default_color if color is None else color)
+
+
+class ScanParserFormBin(ScanParserABC):
+
+    def __init__(self, file_path, chunk_size=1_000_000):
+        super().__init__(file_path)
+        self.chunk_size = chunk_size
+
+    def iter_chunks(self):
+        bin_file = ScanBinFile(self.file_path)
+        header = bin_file.read_header()
+        columns = bin_file.read_columns(header, mode="r")
+        for start in range(0, header["count"], self.chunk_size):
+            stop = start + self.chunk_size
+            # Копия блока, чтобы не держать страницы memmap после обработки
+            yield (np.array(columns["x"][start:stop]), np.array(columns["y"][start:stop]),
+                   np.array(columns["z"][start:stop]), np.array(columns["color"][start:stop]))
+
+    def parse(self, scan, default_color=(0, 0, 0)):
+        for x, y, z, color in self.iter_chunks():
+            scan.add_points(x, y, z, color=color)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from Scan import Scan
+
+    file_path = sys.argv[1] if len(sys.argv) > 1 else "src/SKLD.txt"
+
+    for parser in [ScanParserFormTxt, ScanParserFormTxtWithoutColor, ScanParserFormTxtBulk]:
+        scan = Scan(parser.__name__)
+        t0 = time.perf_counter()
+        scan.load_points_from_file(file_path=file_path, parser=parser)
+        dt = time.perf_counter() - t0
+        print(f"{parser.__name__:<32} {dt:8.3f} s  {len(scan) / dt:12.0f} pts/s  {scan.borders}")
+
+    # Масштабирование параллельного разбора по числу процессов
+    base_time = None
+    processes = 1
+    while processes <= (os.cpu_count() or 1):
+        scan = Scan(f"{ScanParserFormTxtParallel.__name__}_{processes}")
+        t0 = time.perf_counter()
+        scan.load_points_from_file(file_path=file_path, parser=ScanParserFormTxtParallel, processes=processes)
+        dt = time.perf_counter() - t0
+        base_time = base_time or dt
+        print(f"{ScanParserFormTxtParallel.__name__:<26} x{processes:<4} {dt:8.3f} s  "
+              f"{len(scan) / dt:12.0f} pts/s  speedup={base_time / dt:5.2f}")
+        processes *= 2
@@ -1,10 +1,19 @@
-import math
 from abc import ABC, abstractmethod
 
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.colors import TwoSlopeNorm
-from scipy.interpolate import Rbf
+
+from DeformationRaster import DeformationRaster
+from Interpolators import LocalRbfInterpolator
+
+
+def get_deformation_norm(scan, column="deformation"):
+    # Пределы шкалы берутся из статистики скана, без прохода по данным при отрисовке
+    stats = scan.stats[column]
+    if stats.count == 0:
+        return TwoSlopeNorm(vcenter=0)
+    return TwoSlopeNorm(vcenter=0, vmin=min(stats.min, -1e-9), vmax=max(stats.max, 1e-9))
 
 
 class ScanPlotterABC(ABC):
@@ -25,14 +34,7 @@ class ScanPlotterMPL(ScanPlotterABC):
 
     def plot(self, scan):
         ax = plt.figure().add_subplot(projection="3d")
-        x, y, z, c = [], [], [], []
-        for point in scan:
-            x.append(point.x)
-            y.append(point.y)
-            z.append(point.z)
-            rgb = [rgb / 255 for rgb in point.color]
-            c.append(rgb)
-        ax.scatter(x, y, z, c=c)
+        ax.scatter(scan.x, scan.y, scan.z, c=scan.color / 255)
         ax.set_xlabel('X')
         ax.set_ylabel('Y')
         plt.axis('equal')
@@ -54,28 +56,16 @@ class DeformationScanPlotterMPL(ScanPlotterABC):
         y_grid = self.cylinder.circle.r * np.sin(theta_grid) + self.cylinder.y0
         return x_grid, y_grid, z_grid
 
-    def _calc_scaled_point(self, point):
-        azimuth = math.atan2(point.y - self.cylinder.y0,
-                             point.x - self.cylinder.x0)
-        dx = point.deformation * math.cos(azimuth) * self.def_scale
-        dy = point.deformation * math.sin(azimuth) * self.def_scale
-        x = point.x + dx
-        y = point.y + dy
-        from Points import DeformationPoint
-        s_point = DeformationPoint(x=float(x), y=float(y), z=point.z, color=point.color)
-        s_point.deformation = point.deformation
-        return s_point
+    def _calc_scaled_points(self, scan):
+        projection = self.cylinder.get_projection()
+        h, azimuth, radius = projection.to_cylindrical(scan.x, scan.y, scan.z)
+        return projection.from_cylindrical(h, azimuth, radius + scan.deformation * self.def_scale)
 
     def plot(self, scan):
         ax = plt.figure().add_subplot(projection="3d")
-        x, y, z, c = [], [], [], []
-        norm = TwoSlopeNorm(vcenter=0)
-        for point in scan:
-            point = self._calc_scaled_point(point)
-            x.append(point.x)
-            y.append(point.y)
-            z.append(point.z)
-            c.append(point.deformation)
+        norm = get_deformation_norm(scan)
+        x, y, z = self._calc_scaled_points(scan)
+        c = scan.deformation
         ax.scatter(x, y, z, c=c, cmap='seismic', norm=norm)
         if self.plot_cylinder:
             ax.plot_surface(*self._data_for_cylinder_along_z(), alpha=0.5)
@@ -91,16 +81,9 @@ class FlatDeformationScanPlotterMPL:
         self.def_scale = def_scale
         self.plot_flat = plot_flat
 
-    def _calc_scaled_point(self, point):
-        z = point.deformation * self.def_scale
-        from Points import DeformationPoint
-        s_point = DeformationPoint(x=float(point.x), y=float(point.y), z=float(z), color=point.color)
-        s_point.deformation = point.deformation
-        return s_point
-
     def _get_flat_data(self, scan):
-        x = np.linspace(scan.borders["x_min"], scan.borders["x_max"], 50)
-        y = np.linspace(scan.borders["y_min"], scan.borders["y_max"], 50)
+        x = np.linspace(scan.stats.x.min, scan.stats.x.max, 50)
+        y = np.linspace(scan.stats.y.min, scan.stats.y.max, 50)
         x_grid, y_grid = np.meshgrid(x, y)
         z = np.zeros_like(x_grid)
         return x_grid, y_grid, z
@@ -108,14 +91,8 @@ class FlatDeformationScanPlotterMPL:
 
     def plot(self, scan):
         ax = plt.figure().add_subplot(projection="3d")
-        x, y, z, c = [], [], [], []
-        norm = TwoSlopeNorm(vcenter=0)
-        for point in scan:
-            point = self._calc_scaled_point(point)
-            x.append(point.x)
-            y.append(point.y)
-            z.append(point.z)
-            c.append(point.deformation)
+        norm = get_deformation_norm(scan)
+        x, y, z, c = scan.x, scan.y, scan.deformation * self.def_scale, scan.deformation
         ax.scatter(x, y, z, c=c, cmap='seismic', norm=norm)
         if self.plot_flat:
             ax.plot_surface(*self._get_flat_data(scan), alpha=0.5)
@@ -128,23 +105,19 @@ class DeformationInterpolation(ScanPlotterABC):
 
     functions = ['multiquadric', 'inverse', 'gaussian', 'linear', 'cubic', 'quintic', 'thin_plate']
 
-    def __init__(self, function_type="multiquadric", def_scale=1, show_points=False):
+    def __init__(self, function_type="multiquadric", def_scale=1, show_points=False, interpolator=LocalRbfInterpolator):
         self.function_type = function_type
         self.def_scale = def_scale
         self.show_points = show_points
+        self.interpolator = interpolator
 
     def plot(self, scan):
         ax = plt.figure().add_subplot(projection="3d")
         norm = TwoSlopeNorm(vcenter=0)
-        x, y, z, c = [], [], [], []
-        for point in scan:
-            x.append(point.x)
-            y.append(point.y)
-            z.append(point.z * self.def_scale)
-            c.append(point.color)
-        x_grid, y_grid = np.meshgrid(np.linspace(scan.borders["x_min"], scan.borders["x_max"], 100),
-                                     np.linspace(scan.borders["y_min"], scan.borders["y_max"], 100))
-        rbf = Rbf(x, y, z, function=self.function_type)
+        x, y, z, c = scan.x, scan.y, scan.z * self.def_scale, scan.color / 255
+        x_grid, y_grid = np.meshgrid(np.linspace(scan.stats.x.min, scan.stats.x.max, 100),
+                                     np.linspace(scan.stats.y.min, scan.stats.y.max, 100))
+        rbf = self.interpolator(x, y, z, function=self.function_type)
         z_grid = rbf(x_grid, y_grid)
         if self.show_points:
             ax.scatter(x, y, z, c=c, marker='o')
@@ -158,30 +131,32 @@ class DeformationInterpolationHeatMap(ScanPlotterABC):
 
     functions = ['multiquadric', 'inverse', 'gaussian', 'linear', 'cubic', 'quintic', 'thin_plate']
 
-    def __init__(self, function_type="linear", show_points=False):
+    def __init__(self, function_type="linear", show_points=False, interpolator=LocalRbfInterpolator):
         self.function_type = function_type
         self.show_points = show_points
+        self.interpolator = interpolator
 
     def plot(self, scan):
         norm = TwoSlopeNorm(vcenter=0)
-        x, y, z, c = [], [], [], []
-        for point in scan:
-            x.append(point.x)
-            y.append(point.y)
-            z.append(point.z)
-            c.append(point.color)
-        x_grid, y_grid = np.meshgrid(np.linspace(scan.borders["x_min"], scan.borders["x_max"], 100),
-                                     np.linspace(scan.borders["y_min"], scan.borders["y_max"], 1000))
-        rbf = Rbf(x, y, z, function=self.function_type)
-        z_grid = rbf(x_grid, y_grid)
+        x, y, z, c = scan.x, scan.y, scan.z, scan.color / 255
+        if hasattr(scan, "get_deformation_raster") and scan.interpolator is self.interpolator:
+            raster = scan.get_deformation_raster(function=self.function_type)
+        else:
+            rbf = self.interpolator(x, y, z, function=self.function_type)
+            raster = DeformationRaster.create_from_interpolator(rbf,
+                                                                x_min=scan.stats.x.min,
+                                                                x_max=scan.stats.x.max,
+                                                                y_min=scan.stats.y.min,
+                                                                y_max=scan.stats.y.max)
+        x_grid, y_grid = np.meshgrid(raster.x_coords, raster.y_coords)
+        z_grid = raster.values
         # z_grid_rotated = np.rot90(z_grid)
         z_grid_rotated = z_grid.T
 
         plt.figure(figsize=(8, 6))
         if self.show_points:
             plt.scatter(x, y, z, c=c, marker='o')
-        plt.imshow(z_grid_rotated, extent=[scan.borders["y_min"], scan.borders["y_max"],
-                                           scan.borders["x_min"], scan.borders["x_max"]],
+        plt.imshow(z_grid_rotated, extent=[raster.y_min, raster.y_max, raster.x_min, raster.x_max],
                    # origin='lower', cmap='seismic', norm=norm)
                    origin='lower', cmap='bwr', norm=norm)
 
@@ -194,9 +169,8 @@ class DeformationInterpolationHeatMap(ScanPlotterABC):
         plt.clabel(contours, inline=True, fontsize=8)
 
         # Получаем координаты контуров
-        for collection in contours.collections:
-            for path in collection.get_paths():
-                vertices = path.vertices
+        for segments in contours.allsegs:
+            for vertices in segments:
                 x_coords = vertices[:, 0]
                 y_coords = vertices[:, 1]
                 print(f"X coordinates: {x_coords}")
@@ -0,0 +1,110 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class ScanSpatialIndex:
+    # KD-дерево по координатам точек скана + отсортированные по осям индексы,
+    # оба строятся лениво при первом запросе
+
+    def __init__(self, scan, leafsize=32):
+        self.version = scan._version
+        self.leafsize = leafsize
+        self._xyz = np.column_stack((scan.x, scan.y, scan.z))
+        self._tree = None
+        self._sorted = {}
+
+    def __len__(self):
+        return len(self._xyz)
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = cKDTree(self._xyz, leafsize=self.leafsize, balanced_tree=False, compact_nodes=False)
+        return self._tree
+
+    def _get_sorted_axis(self, axis):
+        if axis not in self._sorted:
+            column = self._xyz[:, axis]
+            order = np.argsort(column, kind="stable")
+            self._sorted[axis] = (order, column[order])
+        return self._sorted[axis]
+
+    def _get_axis_range(self, axis, v_min, v_max):
+        order, values = self._get_sorted_axis(axis)
+        start = 0 if v_min is None else np.searchsorted(values, v_min, side="right")
+        stop = len(values) if v_max is None else np.searchsorted(values, v_max, side="left")
+        return order[start:stop]
+
+    def query_box(self, x_min=None, x_max=None, y_min=None, y_max=None, z_min=None, z_max=None):
+        bounds = ((x_min, x_max), (y_min, y_max), (z_min, z_max))
+        limited = [axis for axis, (v_min, v_max) in enumerate(bounds) if v_min is not None or v_max is not None]
+        if len(self) == 0 or not limited:
+            return np.arange(len(self))
+        if len(limited) == 3 and all(None not in limits for limits in bounds):
+            # Кандидаты - шар Чебышева по наибольшей полуоси, дальше точная проверка
+            lower, upper = np.array(bounds, dtype=np.float64).T
+            indices = self.tree.query_ball_point((lower + upper) / 2, r=(upper - lower).max() / 2, p=np.inf)
+            indices = np.sort(np.asarray(indices, dtype=np.intp))
+        else:
+            # Иначе - бинарный поиск по самой узкой из ограниченных осей
+            indices = min((self._get_axis_range(axis, *bounds[axis]) for axis in limited), key=len)
+            indices = np.sort(indices)
+        points = self._xyz[indices]
+        mask = np.ones(len(indices), dtype=bool)
+        for axis in limited:
+            v_min, v_max = bounds[axis]
+            if v_min is not None:
+                mask &= points[:, axis] > v_min
+            if v_max is not None:
+                mask &= points[:, axis] < v_max
+        return indices[mask]
+
+    def query_radius(self, center, radius):
+        if len(self) == 0:
+            return np.empty(0, dtype=np.intp)
+        indices = self.tree.query_ball_point(np.asarray(center, dtype=np.float64), r=radius)
+        return np.sort(np.asarray(indices, dtype=np.intp))
+
+    def k_nearest(self, point, k=1):
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        distances, indices = self.tree.query(np.asarray(point, dtype=np.float64), k=[*range(1, k + 1)])
+        return distances, np.asarray(indices, dtype=np.intp)
+
+
+if __name__ == "__main__":
+    import time
+
+    from Scan import Scan
+
+    rng = np.random.default_rng(0)
+    count = 5_000_000
+    scan = Scan("Bench")
+    angle = rng.uniform(0, 2 * np.pi, count)
+    scan.add_points(22 * np.cos(angle), 22 * np.sin(angle), rng.uniform(0, 10, count))
+
+    t0 = time.perf_counter()
+    index = scan.get_spatial_index()
+    index.query_radius((22, 0, 5), 0.5)
+    index.query_box(z_min=5, z_max=5.1)
+    t1 = time.perf_counter()
+    print(f"Построение индекса: {t1 - t0:.2f} с")
+
+    t0 = time.perf_counter()
+    for z in np.linspace(1, 9, 20):
+        mask = np.flatnonzero((scan.x - 22) ** 2 + scan.y ** 2 + (scan.z - z) ** 2 <= 0.25)
+    t1 = time.perf_counter()
+    for z in np.linspace(1, 9, 20):
+        indices = index.query_radius((22, 0, z), 0.5)
+    t2 = time.perf_counter()
+    print(f"20 запросов по радиусу: линейно {t1 - t0:.3f} с, индекс {t2 - t1:.3f} с")
+
+    t0 = time.perf_counter()
+    for z in np.linspace(1, 9, 20):
+        mask = np.flatnonzero((scan.z > z) & (scan.z < z + 0.1))
+    t1 = time.perf_counter()
+    for z in np.linspace(1, 9, 20):
+        indices = index.query_box(z_min=z, z_max=z + 0.1)
+    t2 = time.perf_counter()
+    print(f"20 срезов по z: линейно {t1 - t0:.3f} с, индекс {t2 - t1:.3f} с")
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+class ColumnStats:
+    # Накопитель статистики колонки: значения поступают блоками, NaN пропускаются
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def __str__(self):
+        return (f"{self.__class__.__name__} (count={self.count}, min={self.min}, max={self.max}, "
+                f"mean={self.mean}, rms={self.rms})")
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size and np.isnan(values).any():
+            values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        v_min, v_max = float(values.min()), float(values.max())
+        self.min = v_min if self.min is None else min(self.min, v_min)
+        self.max = v_max if self.max is None else max(self.max, v_max)
+        self.sum += float(values.sum())
+        self.sum_sq += float(values @ values)
+        self.count += values.size
+        return self
+
+    def add(self, value):
+        value = float(value)
+        if value != value:
+            return self
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+        self.sum += value
+        self.sum_sq += value * value
+        self.count += 1
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        self.count += other.count
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def rms(self):
+        return (self.sum_sq / self.count) ** 0.5 if self.count else None
+
+    @property
+    def std(self):
+        if not self.count:
+            return None
+        mean = self.sum / self.count
+        return max(self.sum_sq / self.count - mean ** 2, 0.0) ** 0.5
+
+
+class ScanStats:
+    # Статистика по всем скалярным вещественным колонкам скана (x, y, z, деформации, ...)
+
+    def __init__(self, names):
+        self.columns = {name: ColumnStats() for name in names}
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns", {})
+        if name not in columns:
+            raise AttributeError(name)
+        return columns[name]
+
+    def __str__(self):
+        return "\n".join(f"{name}: {stats}" for name, stats in self.columns.items())
+
+    @staticmethod
+    def get_stats_columns(scan):
+        return [name for name, column in scan._columns.items() if column.ndim == 1 and column.dtype.kind == "f"]
+
+    @classmethod
+    def create_from_scan(cls, scan, start=0, stop=None):
+        stop = len(scan) if stop is None else stop
+        stats = cls(cls.get_stats_columns(scan))
+        for name in stats.columns:
+            stats.update_column(name, scan._columns[name][start:stop])
+        return stats
+
+    def update_column(self, name, values):
+        self.columns[name].update(values)
+
+    def reset_column(self, name, values):
+        self.columns[name] = ColumnStats().update(values)
+
+    def add_point(self, point):
+        for name, stats in self.columns.items():
+            value = getattr(point, name, None)
+            if value is not None:
+                stats.add(value)
+
+    def merge(self, other):
+        for name, stats in other.columns.items():
+            self.columns.setdefault(name, ColumnStats()).merge(stats)
+        return self
+
+    def get_borders(self):
+        borders = {}
+        for axis in ("x", "y", "z"):
+            borders[f"{axis}_min"] = self.columns[axis].min
+            borders[f"{axis}_max"] = self.columns[axis].max
+        return borders
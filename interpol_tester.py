@@ -1,13 +1,13 @@
 from FlatDeformationScan import FlatDeformationScan
-from ScanFilters import ScanDelimiter
+from ScanFilters import ScanFilterVoxelGrid
 from ScanParsers import ScanParserFormTxtWithoutColor
-from ScanPlotters import FlatDeformationScanPlotterMPL, DeformationInterpolation, DeformationInterpolationHeatMap
+from ScanPlotters import DeformationInterpolationHeatMap
 
 scan = FlatDeformationScan("Flat_DS_OilTank_filtered")
 
 scan.load_points_from_file(file_path="flat_def_scan.txt", parser=ScanParserFormTxtWithoutColor)
 print(scan)
-scan.filter_scan(filter_cls=ScanDelimiter, delimiter=10)
+scan.filter_scan(filter_cls=ScanFilterVoxelGrid, cell_size=(0.1, 0.1, None))
 print(scan)
 
 # scan.plot()
@@ -1,107 +1,306 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# Без интерактивного окна - скрипт запускается на серверах обработки
+matplotlib.use("Agg")
+
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.colors import TwoSlopeNorm
 
-from Circle import Circle
+from ChunkedScan import ChunkedScan
 from Cylinder import Cylinder
 from DeformationCalculators import CylinderDeformationCalculator
 from DeformationScan import DeformationScan
 from FlatDeformationScan import FlatDeformationScan
 from Scan import Scan
-from ScanFilters import ScanDelimiter, ScanFilterFromZminToZmax, ScanFilterFromCylinder
-from ScanParsers import ScanParserFormTxtWithoutColor
-from ScanPlotters import FlatDeformationScanPlotterMPL, DeformationInterpolation, DeformationScanPlotterMPL
+from ScanExporters import ScanExportersToBin, ScanExportersToPly
+from ScanFilters import ScanFilterFromCylinder, ScanFilterFromMask, ScanFilterFromZminToZmax, ScanFilterVoxelGrid
+from ScanParsers import ScanParserFormBin, ScanParserFormLaz, ScanParserFormTxtBulk, ScanParserFormTxtParallel
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.timings = {}
+        self._start = time.perf_counter()
+        self._lap = self._start
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(now - self._lap, 3)
+        self._lap = now
+
+    @property
+    def total(self):
+        return round(time.perf_counter() - self._start, 3)
+
+
+def get_tank_name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def get_float_list(value):
+    try:
+        values = tuple(float(item) for item in value.split(",") if item.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидается список чисел через запятую, получено {value!r}")
+    if not values:
+        raise argparse.ArgumentTypeError("Список допусков пуст")
+    return values
+
+
+def get_fit_kwargs(args):
+    # Последовательность допусков метода trim передается, только если задана явно
+    return {} if args.trim_schedule is None else {"tolerances": args.trim_schedule}
 
-scan = Scan("OilTank")
 
-scan.load_points_from_file(file_path="src/OilTank1.txt", parser=ScanParserFormTxtWithoutColor)
-print(scan)
+def load_scan(file_path, args):
+    name = get_tank_name(file_path)
+    extension = os.path.splitext(file_path)[1].lower()
+    cache_path = f"{os.path.splitext(file_path)[0]}.scan"
+    if extension == ".scan":
+        return Scan.load_scan_from_bin(file_path)
+    if args.cache and os.path.exists(cache_path):
+        return Scan.load_scan_from_bin(cache_path)
+    scan = Scan(name)
+    if extension in (".las", ".laz"):
+        scan.load_points_from_file(file_path, parser=ScanParserFormLaz)
+    else:
+        scan.load_points_from_file(file_path, parser=ScanParserFormTxtParallel, processes=args.parse_processes)
+    if args.cache:
+        scan.export_points_from_file(cache_path, parser=ScanExportersToBin)
+    return scan
 
-# f_scan = scan.filter_scan(filter_cls=ScanDelimiter, replace_points_in_scan=False, delimiter=100)
-# scan.filter_scan(filter_cls=ScanFilterFromZminToZmax, z_min=5, z_max=5.25)
-scan.filter_scan(filter_cls=ScanFilterFromZminToZmax, z_min=2, z_max=8.5)
-# scan.filter_scan(filter_cls=ScanFilterFromZminToZmax, z_min=5, z_max=5.5)
-# scan = scan.filter_scan(filter_cls=ScanDelimiter, replace_points_in_scan=True, delimiter=10)
 
-print(scan)
-# scan.plot()
+def create_chunked_scan(file_path, args):
+    extension = os.path.splitext(file_path)[1].lower()
+    parser = {".scan": ScanParserFormBin, ".las": ScanParserFormLaz, ".laz": ScanParserFormLaz}.get(
+        extension, ScanParserFormTxtBulk)
+    return ChunkedScan(get_tank_name(file_path), file_path, parser=parser, chunk_size=args.chunk_size)
 
-rx = (scan.borders["x_max"] - scan.borders["x_min"]) / 2
-ry = (scan.borders["y_max"] - scan.borders["y_min"]) / 2
-r = (rx + ry) / 2
 
-x0 = scan.borders["x_min"] + rx
-y0 = scan.borders["y_min"] + ry
-#
-#
-# cylinder = Cylinder.best_fit_cylinder_in_scan(x0=x0, y0=y0, r0=r, scan=scan)
-#
-# print(cylinder)
-#
+def get_cylinder_info(cylinder):
+    return {"x0": cylinder.x0,
+            "y0": cylinder.y0,
+            "r": cylinder.r,
+            "z_min": cylinder.z_min,
+            "z_max": cylinder.z_max,
+            "tilt_x": cylinder.tilt_x,
+            "tilt_y": cylinder.tilt_y,
+            "z0": cylinder.z0,
+            }
 
-for tolerance in [0.5, 0.3, 0.2, 0.15, 0.10, 0.075, 0.05]:
-    cylinder = Cylinder.best_fit_cylinder_in_scan(x0=x0, y0=y0, r0=r, scan=scan)
-    scan.filter_scan(filter_cls=ScanFilterFromCylinder, cylinder=cylinder, tolerance=tolerance)
 
+def process_tank_in_memory(file_path, args, timer, report):
+    scan = load_scan(file_path, args)
+    report["count_of_points"] = {"loaded": len(scan)}
+    timer.lap("load")
 
-cylinder = Cylinder.best_fit_cylinder_in_scan(x0=x0, y0=y0, r0=r, scan=scan)
-#
-def_scan = DeformationScan.create_def_scan_from_scan(scan)
-#
-def_scan.calculate_deformation(deformation_calculator=CylinderDeformationCalculator,
-                               cylinder=cylinder)
-#
-print(def_scan)
-def_scan = def_scan.filter_scan(filter_cls=ScanDelimiter, replace_points_in_scan=False, delimiter=10)
-print(def_scan)
+    scan.filter_scan(filter_cls=ScanFilterFromZminToZmax, z_min=args.z_min, z_max=args.z_max)
+    if args.voxel_size:
+        scan.filter_scan(filter_cls=ScanFilterVoxelGrid, cell_size=args.voxel_size, method="nearest")
+    report["count_of_points"]["filtered"] = len(scan)
+    timer.lap("filter")
 
-# def_scan.plot(plotter=DeformationScanPlotterMPL, cylinder=cylinder, def_scale=50, plot_cylinder=True)
-# def_scan.plot(plotter=DeformationScanPlotterFlatMPL, cylinder=cylinder, def_scale=200)
+    cylinder, inlier_mask = Cylinder.robust_fit_cylinder_in_scan(scan=scan, method=args.method,
+                                                                 inlier_tolerance=args.tolerance,
+                                                                 sample_size=args.sample_size,
+                                                                 fit_axis_tilt=args.fit_tilt,
+                                                                 print_log=False,
+                                                                 **get_fit_kwargs(args))
+    scan.filter_scan(filter_cls=ScanFilterFromMask, mask=inlier_mask)
+    report["count_of_points"]["inliers"] = len(scan)
+    timer.lap("fit")
 
+    def_scan = DeformationScan.create_def_scan_from_scan(scan)
+    def_scan.calculate_deformation(deformation_calculator=CylinderDeformationCalculator, cylinder=cylinder)
+    report["deformation"] = {"min": def_scan.min_deformation,
+                             "max": def_scan.max_deformation,
+                             "mse": def_scan.mse,
+                             "percentiles": def_scan.percentiles,
+                             }
+    timer.lap("deformation")
 
+    flat_def_scan = FlatDeformationScan.create_flat_def_scan_from_cylinder_def_scan(def_scan=def_scan,
+                                                                                    cylinder=cylinder)
+    if args.flat_cell_size:
+        flat_def_scan.filter_scan(filter_cls=ScanFilterVoxelGrid, cell_size=(args.flat_cell_size,
+                                                                             args.flat_cell_size, None))
+    return cylinder, flat_def_scan
 
-flat_def_scan = FlatDeformationScan.create_flat_def_scan_from_cylinder_def_scan(def_scan=def_scan, cylinder=cylinder)
 
+def process_tank_in_chunks(file_path, args, timer, report):
+    chunked_scan = create_chunked_scan(file_path, args)
+    chunked_scan.filter_scan(filter_cls=ScanFilterFromZminToZmax, z_min=args.z_min, z_max=args.z_max)
+    if args.voxel_size:
+        # Прореживание выполняется в каждом блоке отдельно
+        chunked_scan.filter_scan(filter_cls=ScanFilterVoxelGrid, cell_size=args.voxel_size, method="nearest")
+    chunked_scan.calc_stats()
+    report["count_of_points"] = {"filtered": chunked_scan.count}
+    timer.lap("load")
 
-# contours = flat_def_scan.get_horizontal_section(z0=def_scan.borders["z_min"],
-#                                                 z_max=def_scan.borders["z_max"], levels_step=2,
-#                                                 count_of_segments=360, def_scale=50)
+    cylinder, tolerance = Cylinder.robust_fit_cylinder_in_chunked_scan(chunked_scan=chunked_scan,
+                                                                       method=args.method,
+                                                                       inlier_tolerance=args.tolerance,
+                                                                       sample_size=args.sample_size,
+                                                                       fit_axis_tilt=args.fit_tilt,
+                                                                       print_log=False,
+                                                                       **get_fit_kwargs(args))
+    chunked_scan.filter_scan(filter_cls=ScanFilterFromCylinder, cylinder=cylinder, tolerance=tolerance)
+    timer.lap("fit")
 
+    def_chunks = chunked_scan.iter_deformation_chunks(CylinderDeformationCalculator, cylinder=cylinder)
+    flat_def_scan = FlatDeformationScan.create_flat_def_scan_from_def_chunks(def_chunks, cylinder=cylinder,
+                                                                             scan_name=f"Flat_DS_{chunked_scan.name}",
+                                                                             cell_size=args.flat_cell_size or 0.05)
+    report["count_of_points"]["inliers"] = chunked_scan.deformation_stats.count
+    report["deformation"] = {"min": chunked_scan.min_deformation,
+                             "max": chunked_scan.max_deformation,
+                             "mse": chunked_scan.mse,
+                             }
+    timer.lap("deformation")
+    return cylinder, flat_def_scan
 
 
+def save_heatmap(flat_def_scan, file_path):
+    raster = flat_def_scan.get_deformation_raster()
+    fig, ax = plt.subplots(figsize=(12, 4))
+    image = ax.imshow(raster.values, extent=[raster.x_min, raster.x_max, raster.y_min, raster.y_max],
+                      origin="lower", aspect="auto", cmap="bwr",
+                      norm=TwoSlopeNorm(vcenter=0, vmin=min(np.nanmin(raster.values), -1e-9),
+                                        vmax=max(np.nanmax(raster.values), 1e-9)))
+    fig.colorbar(image, ax=ax, label="deformation")
+    ax.set_xlabel("H")
+    ax.set_ylabel("Arc")
+    fig.savefig(file_path, dpi=200, bbox_inches="tight")
+    plt.close(fig)
 
-from mpl_toolkits.mplot3d import Axes3D
 
-fig = plt.figure()
+def process_tank(file_path, args):
+    timer = StageTimer()
+    name = get_tank_name(file_path)
+    out_dir = os.path.join(args.out_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    report = {"input": file_path, "name": name, "status": "ok", "outputs": []}
+    try:
+        if args.chunk_size:
+            cylinder, flat_def_scan = process_tank_in_chunks(file_path, args, timer, report)
+        else:
+            cylinder, flat_def_scan = process_tank_in_memory(file_path, args, timer, report)
+        flat_def_scan.def_scale = args.def_scale
+        report["cylinder"] = get_cylinder_info(cylinder)
+        timer.lap("flat_scan")
 
-ax = fig.add_subplot(111, projection='3d')
+        if args.sections_step:
+            file_path_dxf = os.path.join(out_dir, f"{name}_sections.dxf")
+            sections = flat_def_scan.get_circular_sections(levels_step=args.sections_step)
+            flat_def_scan.save_sections_to_dxf(sections, file_path=file_path_dxf)
+            report["outputs"].append(file_path_dxf)
+            timer.lap("sections_dxf")
+        if args.contours_step:
+            file_path_dxf = os.path.join(out_dir, f"{name}_contours.dxf")
+            flat_def_scan.save_flat_contours_to_dxf(levels_step=args.contours_step, file_path=file_path_dxf)
+            report["outputs"].append(file_path_dxf)
+            timer.lap("contours_dxf")
+        for flat_format in args.flat_formats:
+            exporter = {"scan": ScanExportersToBin, "ply": ScanExportersToPly}[flat_format]
+            file_path_flat = os.path.join(out_dir, f"{name}_flat.{flat_format}")
+            flat_def_scan.export_points_from_file(file_path_flat, parser=exporter)
+            report["outputs"].append(file_path_flat)
+        if args.flat_formats:
+            timer.lap("flat_export")
+        if args.heatmap:
+            file_path_png = os.path.join(out_dir, f"{name}_heatmap.png")
+            save_heatmap(flat_def_scan, file_path_png)
+            report["outputs"].append(file_path_png)
+            timer.lap("heatmap")
+    except Exception as error:
+        report["status"] = "error"
+        report["error"] = f"{error.__class__.__name__}: {error}"
+        report["traceback"] = traceback.format_exc()
+    report["timings"] = timer.timings
+    report["total_time"] = timer.total
+    with open(os.path.join(out_dir, f"{name}_report.json"), "w", encoding="UTF-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    return report
 
-contours = flat_def_scan.get_circular_sections(def_scale=50)
 
-for c in contours.values():
-    ax.plot(*c, linewidth=1)
+def get_args_parser():
+    parser = argparse.ArgumentParser(description="Пакетная обработка сканов резервуаров: вписывание цилиндра, "
+                                                 "расчет деформаций, развертка, сечения и отчет")
+    parser.add_argument("inputs", nargs="+", help="файлы сканов (.txt, .las, .laz, .scan)")
+    parser.add_argument("-o", "--out-dir", default="out", help="папка для результатов (по папке на резервуар)")
+    parser.add_argument("--z-min", type=float, default=2.0, help="нижняя граница по Z")
+    parser.add_argument("--z-max", type=float, default=8.5, help="верхняя граница по Z")
+    parser.add_argument("--method", choices=("tukey", "huber", "trim"), default="tukey",
+                        help="робастная оценка при вписывании цилиндра")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="допуск отбора точек стенки, м")
+    parser.add_argument("--trim-schedule", type=get_float_list, default=None,
+                        help="допуски последовательных итераций метода trim через запятую, м "
+                             "(например, 0.5,0.2,0.1,0.05)")
+    parser.add_argument("--sample-size", type=int, default=200_000, help="размер выборки для робастной оценки")
+    parser.add_argument("--no-tilt", dest="fit_tilt", action="store_false", help="не оценивать наклон оси")
+    parser.add_argument("--voxel-size", type=float, default=None, help="прореживание скана по сетке вокселей, м")
+    parser.add_argument("--flat-cell-size", type=float, default=None,
+                        help="прореживание развертки по сетке (высота, дуга), м")
+    parser.add_argument("--def-scale", type=float, default=50, help="масштаб деформаций в сечениях")
+    parser.add_argument("--sections-step", type=float, default=0.01,
+                        help="шаг уровней сечений в DXF, м (0 - не сохранять)")
+    parser.add_argument("--contours-step", type=float, default=0, help="шаг изолиний развертки в DXF, м (0 - нет)")
+    parser.add_argument("--flat-format", dest="flat_formats", action="append", choices=("scan", "ply"), default=[],
+                        help="сохранить развертку (можно указать несколько раз)")
+    parser.add_argument("--heatmap", action="store_true", help="сохранить тепловую карту развертки в PNG")
+    parser.add_argument("--cache", action="store_true",
+                        help="кэшировать текстовые сканы в бинарном формате (не с --chunk-size)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="обработка блоками по N точек без загрузки скана в память целиком")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="число процессов (по одному резервуару на процесс)")
+    parser.add_argument("--parse-processes", type=int, default=1,
+                        help="число процессов разбора одного txt файла (не с --chunk-size)")
+    parser.add_argument("--log", default=None, help="JSON журнал пакета (по умолчанию <out-dir>/batch_log.json)")
+    return parser
 
-# contours = flat_def_scan.get_vertical_section(count_of_section=64, def_scale=50)
-#
-# for c in contours.values():
-#     ax.plot(*c, linewidth=1)
-#
-# contours = flat_def_scan.get_horizontal_section(z0=def_scan.borders["z_min"],
-#                                                 z_max=def_scan.borders["z_max"], levels_step=0.5,
-#                                                 count_of_segments=360, def_scale=50)
-# for c in contours.values():
-#     ax.plot(*c)
 
+def main(argv=None):
+    parser = get_args_parser()
+    args = parser.parse_args(argv)
+    if args.chunk_size:
+        # Блочный режим читает файл заново на каждом проходе, кэш и параллельный разбор к нему не применимы
+        if args.cache:
+            parser.error("--cache не поддерживается вместе с --chunk-size")
+        if args.parse_processes != 1:
+            parser.error("--parse-processes не поддерживается вместе с --chunk-size")
+    os.makedirs(args.out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    processes = min(args.processes or os.cpu_count() or 1, len(args.inputs))
+    if processes == 1:
+        reports = [process_tank(file_path, args) for file_path in args.inputs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(process_tank, file_path, args) for file_path in args.inputs]
+            reports = [future.result() for future in futures]
+    log = {"args": vars(args),
+           "processes": processes,
+           "total_time": round(time.perf_counter() - t0, 3),
+           "tanks": reports,
+           }
+    log_path = args.log or os.path.join(args.out_dir, "batch_log.json")
+    with open(log_path, "w", encoding="UTF-8") as file:
+        json.dump(log, file, ensure_ascii=False, indent=2)
+    for report in reports:
+        status = report["status"] if report["status"] == "ok" else f"{report['status']} ({report['error']})"
+        print(f"{report['name']}: {status}, {report['total_time']:.2f} s")
+    print(f"Журнал: {log_path}")
+    return 0 if all(report["status"] == "ok" for report in reports) else 1
 
-# def data_for_cylinder_along_z(cylinder):
-#     z = np.linspace(cylinder.z_min, cylinder.z_max, 50)
-#     theta = np.linspace(0, 2 * np.pi, 50)
-#     theta_grid, z_grid = np.meshgrid(theta, z)
-#     x_grid = cylinder.circle.r * np.cos(theta_grid) + cylinder.x0
-#     y_grid = cylinder.circle.r * np.sin(theta_grid) + cylinder.y0
-#     return x_grid, y_grid, z_grid
-#
-#
-# ax.plot_surface(*data_for_cylinder_along_z(cylinder), alpha=0.5)
 
-plt.axis('equal')
-plt.show()
+if __name__ == "__main__":
+    raise SystemExit(main())